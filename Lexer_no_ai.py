@@ -1,5 +1,21 @@
 import sys
+import os
 import re
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from itertools import accumulate, repeat
+from operator import add, sub
+from mmap import mmap as memory_map, ACCESS_READ
+from collections.abc import Sequence
+from time import monotonic, perf_counter
+
+# Bump when the token stream produced for the same source changes, so that
+# cached results keyed on it are not reused
+LEXER_VERSION = "2"
 
 # ==================== TOKEN TYPES ====================
 TOKEN_TYPES = {
@@ -14,26 +30,602 @@ TOKEN_TYPES = {
     ]
 }
 
+# Small integer ids used by the columnar TokenBuffer. Token.type holds
+# these same interned name strings, so tokens never carry copies.
+TOKEN_TYPE_NAMES = (
+    "KEYWORD", "IDENTIFIER", "INTEGER", "FLOAT", "STRING", "COMMENT",
+    "PREPROCESSOR", "OPERATOR", "DELIMITER", "NEWLINE", "UNKNOWN",
+)
+TOKEN_TYPE_IDS = {name: type_id for type_id, name in enumerate(TOKEN_TYPE_NAMES)}
+
+# NEWLINE tokens display as an escaped "\n" rather than the raw character
+NEWLINE_VALUE = "\\n"
+
+KEYWORD_SET = frozenset(TOKEN_TYPES["KEYWORD"])
+KEYWORD_BYTES = frozenset(word.encode("ascii") for word in KEYWORD_SET)
+KEYWORD_MAX_LEN = max(len(word) for word in KEYWORD_SET)
+
+# ==================== OPERATORS / DELIMITERS ====================
+MULTI_CHAR_OPS = [
+    "==", "!=", "<=", ">=", "&&", "||", "++", "--",
+    "+=", "-=", "*=", "/=", "<<", ">>", "->", "**", "//",
+]
+SINGLE_OPS = set("+-*/%=<>!&|^~?:@")
+DELIMITERS = set("(){}[];,.")
+
+
+def build_two_char_ops(multi_char_ops=MULTI_CHAR_OPS):
+    # first char -> frozenset of second chars
+    trie = {}
+    for op in multi_char_ops:
+        trie.setdefault(op[0], set()).add(op[1])
+    return {first: frozenset(seconds) for first, seconds in trie.items()}
+
+
+TWO_CHAR_OPS = build_two_char_ops()
+
+# ==================== MASTER REGEX ====================
+# One alternation, tried in the same order as Lexer.lex_next() checks
+# characters, so the regex engine emits exactly the same tokens.
+
+def build_master_pattern(multi_char_ops=MULTI_CHAR_OPS, single_ops=SINGLE_OPS, delimiters=DELIMITERS):
+    def char_class(chars):
+        return "[" + "".join(re.escape(c) for c in sorted(chars)) + "]"
+
+    groups = [
+        ("WHITESPACE", r"[ \t\r]+"),
+        ("NEWLINE", r"\n"),
+        ("PREPROCESSOR", r"#[^\n]*"),
+        ("COMMENT", r"//[^\n]*|/\*[\s\S]*?(?:\*/|\Z)"),
+        ("FLOAT", r"[0-9]+\.[0-9]*"),
+        ("INTEGER", r"[0-9]+"),
+        ("IDENTIFIER", r"[A-Za-z_][A-Za-z0-9_]*"),
+        ("STRING", r'"(?:[^"\\]|\\[\s\S]?)*"?' + "|" + r"'(?:[^'\\]|\\[\s\S]?)*'?"),
+        ("MULTI_OP", "|".join(re.escape(op) for op in multi_char_ops)),
+        ("SINGLE_OP", char_class(single_ops)),
+        ("DELIMITER", char_class(delimiters)),
+        ("UNKNOWN", r"[\s\S]"),
+    ]
+    return re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern in groups))
+
+
+MASTER_PATTERN = build_master_pattern()
+MASTER_PATTERN_BYTES = re.compile(MASTER_PATTERN.pattern.encode("ascii"))
+
+
+def build_group_types(pattern):
+    # group number (match.lastindex) -> token type emitted for it
+    group_types = [None] * (pattern.groups + 1)
+    for name, group in pattern.groupindex.items():
+        group_types[group] = "OPERATOR" if name in ("MULTI_OP", "SINGLE_OP") else name
+    return tuple(group_types)
+
+
+GROUP_TYPES = build_group_types(MASTER_PATTERN)
+WHITESPACE_GROUP = MASTER_PATTERN.groupindex["WHITESPACE"]
+NEWLINE_GROUP = MASTER_PATTERN.groupindex["NEWLINE"]
+IDENTIFIER_GROUP = MASTER_PATTERN.groupindex["IDENTIFIER"]
+UNKNOWN_GROUP = MASTER_PATTERN.groupindex["UNKNOWN"]
+# Groups that may continue into non-ASCII letters or digits
+WORD_GROUPS = frozenset(MASTER_PATTERN.groupindex[name] for name in ("FLOAT", "INTEGER", "IDENTIFIER"))
+# Groups whose text can contain newlines or non-ASCII characters
+FREE_TEXT_GROUPS = frozenset(MASTER_PATTERN.groupindex[name] for name in ("STRING", "COMMENT", "PREPROCESSOR"))
+HIGH_BYTE = re.compile(rb"[\x80-\xff]")
+FOREIGN_RUN = re.compile(r"[A-Za-z0-9_.\x80-\U0010ffff]+")
+FOREIGN_RUN_BYTES = re.compile(rb"[A-Za-z0-9_.\x80-\xff]+")
+
+# Default read size for Lexer.iter_tokens()
+STREAM_CHUNK_SIZE = 1 << 16
+
+# Characters Lexer.relex() rescans past the edit before checking for resync
+RELEX_WINDOW = 256
+
+# Tokens per block of the TokenBlocks stream Lexer.relex() patches
+RELEX_BLOCK = 512
+
+# Characters scanned between deadline checks when a Lexer has a deadline
+DEADLINE_CHECK_CHARS = 1 << 14
+
+# "regex" scans with MASTER_PATTERN, "char" walks the source one character at a time
+ENGINES = ("regex", "char")
+
+# ==================== SOURCE TEXT ====================
+# Sources may be str or UTF-8 bytes (bytes, bytearray, memoryview).
+# Token values are cut out of the source only when someone asks for them.
+def span_text(source, start, end):
+    if isinstance(source, str):
+        return source[start:end]
+    return str(memoryview(source)[start:end], "utf-8", "replace")
+
+
+def count_newlines(source, start, end):
+    newline = "\n" if isinstance(source, str) else b"\n"
+    if hasattr(source, "count"):
+        return source.count(newline, start, end)
+    # mmap objects only offer find()
+    count = 0
+    found = source.find(newline, start, end)
+    while found >= 0:
+        count += 1
+        found = source.find(newline, found + 1, end)
+    return count
+
+
+def extra_utf8_bytes(raw):
+    # bytes beyond the first in each multi-byte UTF-8 character
+    raw = bytes(raw)
+    return len(raw) - len(raw.decode("utf-8", "surrogateescape"))
+
+
+# ==================== LINE INDEX ====================
+class LineIndex:
+    """Offsets where each source line starts, for offset <-> (line, column) lookups."""
+
+    def __init__(self, source):
+        self.source = source
+        self._starts = None
+
+    @property
+    def starts(self):
+        # built on first use with one find() pass over the source
+        if self._starts is None:
+            source = self.source
+            newline = "\n" if isinstance(source, str) else b"\n"
+            starts = array("I" if len(source) < 2 ** 32 else "Q", [0])
+            found = source.find(newline)
+            while found >= 0:
+                starts.append(found + 1)
+                found = source.find(newline, found + 1)
+            self._starts = starts
+        return self._starts
+
+    def position(self, offset):
+        # 1-based (line, column); columns count characters, not bytes
+        line = bisect_right(self.starts, offset)
+        return line, self._column(line, offset)
+
+    def positions(self, offsets):
+        # (line, column) for ascending offsets, walking the index once
+        starts = self.starts
+        count = len(starts)
+        line = 1
+        for offset in offsets:
+            while line < count and starts[line] <= offset:
+                line += 1
+            yield line, self._column(line, offset)
+
+    def _column(self, line, offset):
+        line_start = self.starts[line - 1]
+        column = offset - line_start + 1
+        if not isinstance(self.source, str) and HIGH_BYTE.search(self.source, line_start, offset):
+            column -= extra_utf8_bytes(self.source[line_start:offset])
+        return column
+
+    def offset(self, line, column):
+        # inverse of position()
+        line_start = self.starts[line - 1]
+        if isinstance(self.source, str):
+            return line_start + column - 1
+        # a character is at most 4 bytes, so this window holds the prefix
+        raw = bytes(self.source[line_start:line_start + 4 * (column - 1)])
+        prefix = raw.decode("utf-8", "surrogateescape")[:column - 1]
+        return line_start + len(prefix.encode("utf-8", "surrogateescape"))
+
+
+def format_token_row(token_type, value, line, column):
+    return f"| {token_type:<16} | {value:<30} | Ln {line:<4} Col {column:<4} |"
+
+
+# ==================== INSTRUMENTATION ====================
+# Called as hook(lexer, tokens, seconds, chars) after every scan: each
+# Lexer.tokenize(), each iter_batches() batch and each relex() rescan, with
+# the tokens and the number of source characters that scan covered.
+# With no hook installed the lexer does no timing at all.
+_tokenize_hook = None
+
+
+def set_tokenize_hook(hook):
+    # Install hook (or None to switch instrumentation off); returns the previous one
+    global _tokenize_hook
+    previous, _tokenize_hook = _tokenize_hook, hook
+    return previous
+
+
 # ==================== TOKEN CLASS ====================
 class Token:
-    def __init__(self, token_type, value, line, column):
+    __slots__ = ("type", "_value", "_line", "_column", "start", "end", "source", "lines")
+
+    def __init__(self, token_type, value, line, column, start=None, end=None, source=None, lines=None):
+        # line/column may be None when a LineIndex is given: they are then
+        # looked up from the token's start offset the first time they are read
         self.type = token_type
-        self.value = value
-        self.line = line
-        self.column = column
+        self._value = value
+        self._line = line
+        self._column = column
+        self.start = start
+        self.end = end
+        self.source = source
+        self.lines = lines
+
+    def _resolve_position(self):
+        self._line, self._column = self.lines.position(self.start)
+
+    @property
+    def line(self):
+        if self._line is None and self.lines is not None:
+            self._resolve_position()
+        return self._line
+
+    @line.setter
+    def line(self, line):
+        self._line = line
+
+    @property
+    def column(self):
+        if self._column is None and self.lines is not None:
+            self._resolve_position()
+        return self._column
+
+    @column.setter
+    def column(self, column):
+        self._column = column
+
+    @property
+    def value(self):
+        if self._value is None and self.source is not None:
+            self._value = span_text(self.source, self.start, self.end)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    @property
+    def type_id(self):
+        return TOKEN_TYPE_IDS[self.type]
+
+    @property
+    def span(self):
+        return (self.start, self.end)
 
     def __str__(self):
-        return f"| {self.type:<16} | {self.value:<30} | Ln {self.line:<4} Col {self.column:<4} |"
+        return format_token_row(self.type, self.value, self.line, self.column)
+
+
+# What Lexer.relex() changed: tokens[index:index + removed] were replaced by inserted
+TokenDelta = namedtuple("TokenDelta", ["index", "removed", "inserted"])
+
+
+# ==================== TOKEN BUFFER ====================
+class TokenBuffer(Sequence):
+    """Columnar token storage: one array per field instead of one object per token."""
+
+    def __init__(self, source, line_index=None):
+        # with a line_index, lines/columns stay empty and are looked up on read
+        self.source = source
+        self.line_index = line_index
+        offset_code = "I" if len(source) < 2 ** 32 else "Q"
+        self.types = array("B")
+        self.starts = array(offset_code)
+        self.ends = array(offset_code)
+        self.lines = array("I")
+        self.columns = array("I")
+
+    def add(self, type_id, start, end, line, column):
+        self.types.append(type_id)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+        self.columns.append(column)
+
+    def add_span(self, type_id, start, end):
+        self.types.append(type_id)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append(self, token):
+        if self.line_index is not None:
+            self.add_span(TOKEN_TYPE_IDS[token.type], token.start, token.end)
+        else:
+            self.add(TOKEN_TYPE_IDS[token.type], token.start, token.end, token.line, token.column)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("token index out of range")
+        token_type = TOKEN_TYPE_NAMES[self.types[index]]
+        value = NEWLINE_VALUE if token_type == "NEWLINE" else None
+        if self.line_index is not None:
+            return Token(token_type, value, None, None,
+                         self.starts[index], self.ends[index], self.source, self.line_index)
+        return Token(token_type, value, self.lines[index], self.columns[index],
+                     self.starts[index], self.ends[index], self.source)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def value(self, index):
+        if self.types[index] == TOKEN_TYPE_IDS["NEWLINE"]:
+            return NEWLINE_VALUE
+        return span_text(self.source, self.starts[index], self.ends[index])
+
+    def rows(self, first=0, stop=None):
+        # (type, value, line, column) tuples without building Token objects,
+        # for tokens first..stop-1 (all of them by default)
+        source = self.source
+        newline_id = TOKEN_TYPE_IDS["NEWLINE"]
+        types, starts, ends, lines, columns = self.types, self.starts, self.ends, self.lines, self.columns
+        if first or stop is not None:
+            window = slice(first, stop)
+            types, starts, ends = types[window], starts[window], ends[window]
+            lines, columns = lines[window], columns[window]
+        if self.line_index is None:
+            positions = zip(lines, columns)
+        else:
+            positions = self.line_index.positions(starts)
+        for type_id, start, end, (line, column) in zip(types, starts, ends, positions):
+            value = NEWLINE_VALUE if type_id == newline_id else span_text(source, start, end)
+            yield TOKEN_TYPE_NAMES[type_id], value, line, column
+
+    def type_counts(self):
+        counts = [0] * len(TOKEN_TYPE_NAMES)
+        for type_id in self.types:
+            counts[type_id] += 1
+        return {TOKEN_TYPE_NAMES[type_id]: n for type_id, n in enumerate(counts) if n}
+
+
+# ==================== EDITABLE TOKEN STREAM ====================
+class TokenBlocks(Sequence):
+    """Token stream that Lexer.relex() patches without touching every token.
+
+    Tokens are stored columnar in blocks of about RELEX_BLOCK. Offsets and
+    lines inside a block are relative to the block's first token, and each
+    block only records how far its first token is from the previous block's.
+    An edit rewrites the blocks it overlaps; everything after it moves by
+    changing one of those distances.
+    """
+
+    def __init__(self, source, block_size=RELEX_BLOCK):
+        self.source = source
+        self.block_size = block_size
+        self.blocks = []  # [(types, starts, ends, lines, columns), ...]
+        self.sizes = []  # tokens per block
+        self.spans = []  # first offset of each block minus the previous block's
+        self.line_spans = []  # the same for first lines
+        self._layout_cache = None
+
+    @classmethod
+    def from_tokens(cls, source, tokens, block_size=RELEX_BLOCK):
+        # tokens: a Token list or a TokenBuffer lexed from source
+        stream = cls(source, block_size)
+        if isinstance(tokens, TokenBuffer) and tokens.line_index is None:
+            rows = (tokens.types, tokens.starts, tokens.ends, tokens.lines, tokens.columns)
+        else:
+            rows = stream._token_rows(tokens)
+        stream._insert_blocks(0, 0, rows, 0, 0)
+        return stream
+
+    @staticmethod
+    def _token_rows(tokens):
+        return (
+            [TOKEN_TYPE_IDS[token.type] for token in tokens],
+            [token.start for token in tokens],
+            [token.end for token in tokens],
+            [token.line for token in tokens],
+            [token.column for token in tokens],
+        )
+
+    def _layout(self):
+        # (index of each block's first token plus the total, absolute first
+        # offsets, absolute first lines), rebuilt once after each edit
+        if self._layout_cache is None:
+            self._layout_cache = (
+                list(accumulate(self.sizes, initial=0)),
+                list(accumulate(self.spans)),
+                list(accumulate(self.line_spans)),
+            )
+        return self._layout_cache
+
+    def _insert_blocks(self, at, stop, rows, prev_base, prev_line):
+        # Replace blocks[at:stop] with absolute rows cut into even blocks;
+        # returns the new blocks' last (base, line) for the next span
+        types, starts, ends, lines, columns = rows
+        total = len(types)
+        pieces = -(-total // self.block_size)
+        step = -(-total // pieces) if pieces else 1
+        blocks, sizes, spans, line_spans = [], [], [], []
+        for i in range(0, total, step):
+            window = slice(i, i + step)
+            base, base_line = starts[i], lines[i]
+            blocks.append((
+                array("B", types[window]),
+                array("q", map(sub, starts[window], repeat(base))),
+                array("q", map(sub, ends[window], repeat(base))),
+                array("q", map(sub, lines[window], repeat(base_line))),
+                array("q", columns[window]),
+            ))
+            sizes.append(len(blocks[-1][0]))
+            spans.append(base - prev_base)
+            line_spans.append(base_line - prev_line)
+            prev_base, prev_line = base, base_line
+        self.blocks[at:stop] = blocks
+        self.sizes[at:stop] = sizes
+        self.spans[at:stop] = spans
+        self.line_spans[at:stop] = line_spans
+        self._layout_cache = None
+        return prev_base, prev_line
+
+    def _block_rows(self, k, first, bases, line_bases, shift=0, line_shift=0):
+        # absolute rows of blocks[k] from index first on, moved by the shifts
+        types, starts, ends, lines, columns = self.blocks[k]
+        base, base_line = bases[k] + shift, line_bases[k] + line_shift
+        return (
+            types[first:],
+            list(map(add, starts[first:], repeat(base))),
+            list(map(add, ends[first:], repeat(base))),
+            list(map(add, lines[first:], repeat(base_line))),
+            columns[first:].tolist(),
+        )
+
+    def __len__(self):
+        return self._layout()[0][-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        firsts, bases, line_bases = self._layout()
+        if index < 0:
+            index += firsts[-1]
+        if not 0 <= index < firsts[-1]:
+            raise IndexError("token index out of range")
+        k = bisect_right(firsts, index) - 1
+        return self._token(k, index - firsts[k], bases[k], line_bases[k])
+
+    def _token(self, k, j, base, base_line):
+        types, starts, ends, lines, columns = self.blocks[k]
+        token_type = TOKEN_TYPE_NAMES[types[j]]
+        value = NEWLINE_VALUE if token_type == "NEWLINE" else None
+        return Token(token_type, value, base_line + lines[j], columns[j],
+                     base + starts[j], base + ends[j], self.source)
+
+    def __iter__(self):
+        _, bases, line_bases = self._layout()
+        for k, block in enumerate(self.blocks):
+            base, base_line = bases[k], line_bases[k]
+            for j in range(len(block[0])):
+                yield self._token(k, j, base, base_line)
+
+    def index_of_end(self, offset):
+        # index of the first token ending at or after offset
+        if not self.blocks:
+            return 0
+        firsts, bases, _ = self._layout()
+        k = max(bisect_left(bases, offset) - 1, 0)
+        return firsts[k] + bisect_left(self.blocks[k][2], offset - bases[k])
+
+    def index_of_start(self, offset, lo=0):
+        # index of the first token starting at or after offset, at least lo
+        if not self.blocks:
+            return 0
+        firsts, bases, _ = self._layout()
+        k = max(bisect_right(bases, offset) - 1, 0)
+        return max(firsts[k] + bisect_left(self.blocks[k][1], offset - bases[k]), lo)
+
+    def replace(self, first, stop, inserted, source, shift=0, line_shift=0, column_shift=0, sync_line=None):
+        # tokens[first:stop] become the Token list `inserted`; tokens from stop
+        # on move by shift characters and line_shift lines, plus column_shift
+        # columns for those still on their old line sync_line
+        firsts, bases, line_bases = self._layout()
+        count = len(self.blocks)
+        if count:
+            lo = min(bisect_right(firsts, first) - 1, count - 1)
+            hi = min(bisect_right(firsts, stop) - 1, count - 1)
+        else:
+            lo, hi = 0, -1
+
+        # the rewritten rows: kept head of block lo, the new tokens, and the
+        # shifted rest of block hi (with the next block too if that is small)
+        rows = tuple([] for _ in range(5))
+        if count:
+            head = self._block_rows(lo, 0, bases, line_bases)
+            for column, values in zip(rows, head):
+                column.extend(values[:first - firsts[lo]])
+        for column, values in zip(rows, self._token_rows(inserted)):
+            column.extend(values)
+        tail_start = len(rows[0])
+        if count and stop < firsts[-1]:
+            tail = self._block_rows(hi, stop - firsts[hi], bases, line_bases, shift, line_shift)
+            for column, values in zip(rows, tail):
+                column.extend(values)
+            if len(rows[0]) < self.block_size // 2 and hi + 1 < count:
+                hi += 1
+                for column, values in zip(rows, self._block_rows(hi, 0, bases, line_bases, shift, line_shift)):
+                    column.extend(values)
+        if column_shift:
+            lines, columns = rows[3], rows[4]
+            moved_line = sync_line + line_shift
+            for i in range(tail_start, len(lines)):
+                if lines[i] != moved_line:
+                    break
+                columns[i] += column_shift
+            else:
+                # a line longer than the rewritten rows: fix the blocks after
+                for k in range(hi + 1, count):
+                    if line_bases[k] != sync_line:
+                        break
+                    block_lines, block_columns = self.blocks[k][3], self.blocks[k][4]
+                    for j in range(len(block_lines)):
+                        if block_lines[j]:
+                            break
+                        block_columns[j] += column_shift
+                    else:
+                        continue
+                    break
+
+        prev_base = bases[lo - 1] if lo > 0 else 0
+        prev_line = line_bases[lo - 1] if lo > 0 else 0
+        prev_base, prev_line = self._insert_blocks(lo, hi + 1, rows, prev_base, prev_line)
+        # the first untouched block keeps its rows and moves as a whole
+        after = hi + 1 + len(self.blocks) - count
+        if after < len(self.blocks):
+            self.spans[after] = bases[hi + 1] + shift - prev_base
+            self.line_spans[after] = line_bases[hi + 1] + line_shift - prev_line
+        self.source = source
+        self._layout_cache = None
 
 
 # ==================== LEXER CLASS ====================
 class Lexer:
-    def __init__(self, source):
+    def __init__(self, source, engine="regex", columnar=False, lazy_positions=False, deadline=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown lexer engine '{engine}' (choose from {', '.join(ENGINES)})")
+        if not isinstance(source, str) and engine == "char":
+            # the char engine compares characters, not bytes
+            source = span_text(source, 0, len(source))
         self.source = source
+        self.engine = engine
         self.pos = 0
         self.line = 1
         self.column = 1
-        self.tokens = []
+        self.columnar = columnar
+        # lazy_positions: tokens keep offsets only; line/column come from
+        # self.line_index when read, so the scanner skips that bookkeeping
+        self.line_index = LineIndex(source) if lazy_positions else None
+        self.tokens = TokenBuffer(source, self.line_index) if columnar else []
+        self.mapping = None
+        # deadline: a time.monotonic() value. tokenize() then stops at the
+        # first token boundary after it and sets truncated
+        self.deadline = deadline
+        self.truncated = False
+
+    @classmethod
+    def from_path(cls, path, mmap=True, **options):
+        # mmap=True scans the mapped UTF-8 bytes in place: nothing is decoded
+        # or copied up front, only the token values that get read
+        if not mmap:
+            with open(path, 'r') as f:
+                return cls(f.read(), **options)
+        with open(path, 'rb') as f:
+            try:
+                mapping = memory_map(f.fileno(), 0, access=ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                return cls(b"", **options)
+        lexer = cls(mapping, **options)
+        lexer.mapping = mapping
+        return lexer
+
+    def close(self):
+        # token values are read from the mapping, so close only when done with them
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
 
     def current_char(self):
         if self.pos < len(self.source):
@@ -57,14 +649,28 @@ class Lexer:
         while self.current_char() is not None and self.current_char() in ' \t\r':
             self.advance()
 
-    def add_token(self, token_type, value, line, column):
-        self.tokens.append(Token(token_type, value, line, column))
+    def add_span(self, token_type, start, line, column):
+        # token covers source[start:self.pos]; its value is sliced on demand
+        self.emit(token_type, start, self.pos, line, column)
+
+    def emit(self, token_type, start, end, line, column):
+        lines = self.line_index
+        if self.columnar:
+            if lines is None:
+                self.tokens.add(TOKEN_TYPE_IDS[token_type], start, end, line, column)
+            else:
+                self.tokens.add_span(TOKEN_TYPE_IDS[token_type], start, end)
+        else:
+            value = NEWLINE_VALUE if token_type == "NEWLINE" else None
+            if lines is not None:
+                line = column = None
+            self.tokens.append(Token(token_type, value, line, column, start, end, self.source, lines))
 
     # ---------- NUMBER ----------
     def lex_number(self):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        num_str = ""
         is_float = False
 
         while self.current_char() is not None and (self.current_char().isdigit() or self.current_char() == '.'):
@@ -72,179 +678,520 @@ class Lexer:
                 if is_float:
                     break
                 is_float = True
-            num_str += self.current_char()
             self.advance()
 
         token_type = "FLOAT" if is_float else "INTEGER"
-        self.add_token(token_type, num_str, start_line, start_col)
+        self.add_span(token_type, start, start_line, start_col)
 
     # ---------- IDENTIFIER / KEYWORD ----------
     def lex_identifier(self):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        word = ""
 
         while self.current_char() is not None and (self.current_char().isalnum() or self.current_char() == '_'):
-            word += self.current_char()
             self.advance()
 
-        if word in TOKEN_TYPES["KEYWORD"]:
-            self.add_token("KEYWORD", word, start_line, start_col)
+        word = self.source[start:self.pos]
+        if word in KEYWORD_SET:
+            self.add_span("KEYWORD", start, start_line, start_col)
         else:
-            self.add_token("IDENTIFIER", word, start_line, start_col)
+            self.add_span("IDENTIFIER", start, start_line, start_col)
 
     # ---------- STRING ----------
     def lex_string(self, quote_char):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        string_val = quote_char
         self.advance()  # skip opening quote
 
         while self.current_char() is not None and self.current_char() != quote_char:
             if self.current_char() == '\\':
-                string_val += self.current_char()
                 self.advance()
             if self.current_char() is not None:
-                string_val += self.current_char()
                 self.advance()
 
         if self.current_char() == quote_char:
-            string_val += self.current_char()
             self.advance()
 
-        self.add_token("STRING", string_val, start_line, start_col)
+        self.add_span("STRING", start, start_line, start_col)
 
     # ---------- SINGLE-LINE COMMENT ----------
     def lex_single_comment(self):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        comment = ""
 
         while self.current_char() is not None and self.current_char() != '\n':
-            comment += self.current_char()
             self.advance()
 
-        self.add_token("COMMENT", comment, start_line, start_col)
+        self.add_span("COMMENT", start, start_line, start_col)
 
     # ---------- MULTI-LINE COMMENT ----------
     def lex_multi_comment(self):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        comment = "/*"
         self.advance()  # skip '/'
         self.advance()  # skip '*'
 
         while self.current_char() is not None:
             if self.current_char() == '*' and self.peek_char() == '/':
-                comment += "*/"
                 self.advance()
                 self.advance()
                 break
-            comment += self.current_char()
             self.advance()
 
-        self.add_token("COMMENT", comment, start_line, start_col)
+        self.add_span("COMMENT", start, start_line, start_col)
 
     # ---------- PREPROCESSOR ----------
     def lex_preprocessor(self):
+        start = self.pos
         start_line = self.line
         start_col = self.column
-        directive = ""
 
         while self.current_char() is not None and self.current_char() != '\n':
-            directive += self.current_char()
             self.advance()
 
-        self.add_token("PREPROCESSOR", directive, start_line, start_col)
+        self.add_span("PREPROCESSOR", start, start_line, start_col)
 
     # ---------- NEWLINE ----------
     def lex_newline(self):
         start_line = self.line
         start_col = self.column
-        self.add_token("NEWLINE", "\\n", start_line, start_col)
+        self.emit("NEWLINE", self.pos, self.pos + 1, start_line, start_col)
         self.advance()
 
-    # ==================== MAIN TOKENIZE ====================
-    def tokenize(self):
-        multi_char_ops = [
-            "==", "!=", "<=", ">=", "&&", "||", "++", "--",
-            "+=", "-=", "*=", "/=", "<<", ">>", "->", "**", "//",
-        ]
+    # ---------- SLASH: COMMENT OR OPERATOR ----------
+    def lex_slash(self, ch):
+        nxt = self.peek_char()
+        if nxt == '/':
+            self.lex_single_comment()
+        elif nxt == '*':
+            self.lex_multi_comment()
+        else:
+            self.lex_operator(ch)
+
+    # ---------- OPERATOR ----------
+    def lex_operator(self, ch):
+        start, line, column = self.pos, self.line, self.column
+        self.advance()
+        if self.current_char() in TWO_CHAR_OPS.get(ch, ()):
+            self.advance()
+        self.add_span("OPERATOR", start, line, column)
+
+    # ---------- SINGLE-CHARACTER TOKEN ----------
+    def lex_delimiter(self, ch):
+        start, line, column = self.pos, self.line, self.column
+        self.advance()
+        self.add_span("DELIMITER", start, line, column)
 
-        single_ops = set("+-*/%=<>!&|^~?:@")
-        delimiters = set("(){}[];,.")
+    def lex_unknown(self, ch):
+        start, line, column = self.pos, self.line, self.column
+        self.advance()
+        self.add_span("UNKNOWN", start, line, column)
+
+    # ---------- CHARACTERS PAST LATIN-1 ----------
+    def lex_wide_char(self, ch):
+        if ch.isdigit():
+            self.lex_number()
+        elif ch.isalpha():
+            self.lex_identifier()
+        else:
+            self.lex_unknown(ch)
+
+    # ---------- ONE TOKEN (char engine) ----------
+    def lex_next(self):
+        # one table lookup on the first character picks the handler
+        ch = self.current_char()
+        code = ord(ch)
+        if code < 256:
+            FIRST_CHAR_HANDLERS[code](self, ch)
+        else:
+            self.lex_wide_char(ch)
+
+    # ---------- NON-ASCII RUN (bytes sources) ----------
+    def lex_foreign_bytes(self, start, line, column):
+        # Decode only the identifier-like run around the non-ASCII bytes and
+        # classify it with the char engine, mapping offsets back to bytes.
+        end = FOREIGN_RUN_BYTES.match(self.source, start).end()
+        text = bytes(self.source[start:end]).decode("utf-8", "surrogateescape")
+        sub = Lexer(text, engine="char")
+        sub.line, sub.column = line, column
+
+        # run_engine, not tokenize: this run is part of the caller's scan and
+        # must not reach the tokenize hook a second time
+        offset, consumed = start, 0
+        for token in sub.run_engine():
+            token_start = offset + len(text[consumed:token.start].encode("utf-8", "surrogateescape"))
+            offset = token_start + len(text[token.start:token.end].encode("utf-8", "surrogateescape"))
+            consumed = token.end
+            self.emit(token.type, token_start, offset, token.line, token.column)
+        return end, (end - start) - len(text)
 
+    # ==================== MAIN TOKENIZE ====================
+    def tokenize(self):
+        hook = _tokenize_hook
+        if hook is None:
+            return self.run_engine()
+        begin = self.pos
+        started = perf_counter()
+        tokens = self.run_engine()
+        hook(self, tokens, perf_counter() - started, self.pos - begin)
+        return tokens
+
+    def run_engine(self):
+        if self.deadline is None:
+            return self.scan()
+        # Check the clock every DEADLINE_CHECK_CHARS rather than per token
         while self.pos < len(self.source):
-            self.skip_whitespace()
-            ch = self.current_char()
+            if monotonic() >= self.deadline:
+                self.truncated = True
+                break
+            self.scan(self.pos + DEADLINE_CHECK_CHARS)
+        return self.tokens
 
-            if ch is None:
+    def scan(self, stop=None):
+        # stop=N ends the scan at the first token boundary at or after N
+        if self.engine == "regex":
+            if self.line_index is not None:
+                return self.tokenize_offsets(stop)
+            return self.tokenize_regex(stop=stop)
+        return self.tokenize_chars(stop)
+
+    # ---------- CHAR ENGINE ----------
+    def tokenize_chars(self, stop=None):
+        limit = len(self.source) if stop is None else min(stop, len(self.source))
+        while self.pos < limit:
+            self.skip_whitespace()
+            if self.current_char() is None:
                 break
+            self.lex_next()
 
-            # --- Newline ---
-            if ch == '\n':
-                self.lex_newline()
-                continue
+        return self.tokens
 
-            # --- Preprocessor ---
-            if ch == '#':
-                self.lex_preprocessor()
+    # ---------- REGEX ENGINE ----------
+    def tokenize_regex(self, final=True, stop=None):
+        # final=False means more source may follow: stop before any token
+        # that runs into the end of self.source, leaving pos/line/column there.
+        # stop=N ends the scan at the first token boundary at or after N.
+        source = self.source
+        is_text = isinstance(source, str)
+        if is_text:
+            match = MASTER_PATTERN.match
+            keywords, newline, high = KEYWORD_SET, "\n", "\x80"
+        else:
+            match = MASTER_PATTERN_BYTES.match
+            keywords, newline, high = KEYWORD_BYTES, b"\n", 0x80
+        length = len(source)
+        tokens = self.tokens
+        group_types = GROUP_TYPES
+        columnar = self.columnar
+        if columnar:
+            add_row = tokens.add
+            type_ids = TOKEN_TYPE_IDS
+            newline_id = TOKEN_TYPE_IDS["NEWLINE"]
+
+        # column = pos - line_start - wide + 1, where "wide" counts the extra
+        # bytes of multi-byte UTF-8 characters already seen on this line
+        pos = self.pos
+        line = self.line
+        line_start = pos - (self.column - 1)
+        wide = 0
+        limit = length if stop is None else min(stop, length)
+
+        while pos < limit:
+            m = match(source, pos)
+            group = m.lastindex
+            end = m.end()
+
+            if group == WHITESPACE_GROUP:
+                pos = end
                 continue
 
-            # --- Comments ---
-            if ch == '/' and self.peek_char() == '/':
-                self.lex_single_comment()
-                continue
-            if ch == '/' and self.peek_char() == '*':
-                self.lex_multi_comment()
-                continue
-            # Python single-line comment
-            if ch == '#':
-                self.lex_single_comment()
+            column = pos - line_start - wide + 1
+
+            if group == NEWLINE_GROUP:
+                if columnar:
+                    add_row(newline_id, pos, end, line, column)
+                else:
+                    tokens.append(Token("NEWLINE", NEWLINE_VALUE, line, column, pos, end, source))
+                line += 1
+                line_start = end
+                wide = 0
+                pos = end
                 continue
 
-            # --- Numbers ---
-            if ch.isdigit():
-                self.lex_number()
-                continue
+            if end == length and not final:
+                break
 
-            # --- Identifiers / Keywords ---
-            if ch.isalpha() or ch == '_':
-                self.lex_identifier()
+            # Non-ASCII code outside strings/comments is rare; let the char
+            # engine classify it so str.isalpha()/isdigit() semantics match.
+            if (group == UNKNOWN_GROUP and source[pos] >= high) or (
+                group in WORD_GROUPS and end < length and source[end] >= high
+            ):
+                if not final and (FOREIGN_RUN if is_text else FOREIGN_RUN_BYTES).match(source, pos).end() == length:
+                    break
+                if is_text:
+                    self.pos, self.line, self.column = pos, line, column
+                    self.lex_next()
+                    pos = self.pos
+                    line_start = pos - (self.column - 1)
+                else:
+                    pos, extra = self.lex_foreign_bytes(pos, line, column)
+                    wide += extra
                 continue
 
-            # --- Strings ---
-            if ch in ('"', "'"):
-                self.lex_string(ch)
-                continue
+            kind = group_types[group]
+            if group == IDENTIFIER_GROUP and end - pos <= KEYWORD_MAX_LEN and source[pos:end] in keywords:
+                kind = "KEYWORD"
+            if columnar:
+                add_row(type_ids[kind], pos, end, line, column)
+            else:
+                tokens.append(Token(kind, None, line, column, pos, end, source))
+
+            # Strings, comments and directives may hold newlines or
+            # multi-byte characters
+            if group in FREE_TEXT_GROUPS:
+                last_newline = source.rfind(newline, pos, end)
+                if last_newline >= 0:
+                    line += count_newlines(source, pos, last_newline + 1)
+                    line_start = last_newline + 1
+                    wide = 0
+                if not is_text and HIGH_BYTE.search(source, max(pos, line_start), end):
+                    wide += extra_utf8_bytes(source[max(pos, line_start):end])
+            pos = end
+
+        self.pos = pos
+        self.line = line
+        self.column = pos - line_start - wide + 1
+        return self.tokens
 
-            # --- Multi-character operators ---
-            if self.peek_char() is not None:
-                two_char = ch + self.peek_char()
-                if two_char in multi_char_ops:
-                    self.add_token("OPERATOR", two_char, self.line, self.column)
-                    self.advance()
-                    self.advance()
-                    continue
-
-            # --- Single-character operators ---
-            if ch in single_ops:
-                self.add_token("OPERATOR", ch, self.line, self.column)
-                self.advance()
+    # ---------- REGEX ENGINE, OFFSETS ONLY ----------
+    def tokenize_offsets(self, stop=None):
+        # Same scan as tokenize_regex() without line/column tracking;
+        # tokens resolve their position through self.line_index when asked
+        source = self.source
+        is_text = isinstance(source, str)
+        if is_text:
+            match = MASTER_PATTERN.match
+            keywords, high = KEYWORD_SET, "\x80"
+        else:
+            match = MASTER_PATTERN_BYTES.match
+            keywords, high = KEYWORD_BYTES, 0x80
+        length = len(source)
+        tokens = self.tokens
+        lines = self.line_index
+        group_types = GROUP_TYPES
+        columnar = self.columnar
+        if columnar:
+            add_span = tokens.add_span
+            type_ids = TOKEN_TYPE_IDS
+
+        pos = self.pos
+        limit = length if stop is None else min(stop, length)
+        while pos < limit:
+            m = match(source, pos)
+            group = m.lastindex
+            end = m.end()
+
+            if group == WHITESPACE_GROUP:
+                pos = end
                 continue
 
-            # --- Delimiters ---
-            if ch in delimiters:
-                self.add_token("DELIMITER", ch, self.line, self.column)
-                self.advance()
+            if (group == UNKNOWN_GROUP and source[pos] >= high) or (
+                group in WORD_GROUPS and end < length and source[end] >= high
+            ):
+                # positions passed here are ignored: emit() drops them
+                if is_text:
+                    self.pos = pos
+                    self.lex_next()
+                    pos = self.pos
+                else:
+                    pos = self.lex_foreign_bytes(pos, 1, 1)[0]
                 continue
 
-            # --- Unknown ---
-            self.add_token("UNKNOWN", ch, self.line, self.column)
-            self.advance()
-
+            kind = group_types[group]
+            if group == IDENTIFIER_GROUP and end - pos <= KEYWORD_MAX_LEN and source[pos:end] in keywords:
+                kind = "KEYWORD"
+            if columnar:
+                add_span(type_ids[kind], pos, end)
+            else:
+                value = NEWLINE_VALUE if group == NEWLINE_GROUP else None
+                tokens.append(Token(kind, value, None, None, pos, end, source, lines))
+            pos = end
+
+        self.pos = pos
         return self.tokens
 
+    # ==================== INCREMENTAL RE-LEX ====================
+    def relex(self, previous_tokens, edit_offset, removed_len, inserted_text):
+        # Apply an edit to self.source and patch previous_tokens (the tokens
+        # lexed from it) instead of tokenizing everything again.
+        # Returns (TokenDelta, TokenBlocks); pass that stream back in for the
+        # next edit. Only the rescanned text and the blocks around the edit
+        # are rewritten: the reused tail moves without being touched.
+        # Past self.deadline nothing is patched: returns (None, tokens) with
+        # the source and tokens as they were, and sets self.truncated.
+        self.truncated = False
+        old_source = self.source
+        if not isinstance(previous_tokens, TokenBlocks):
+            previous_tokens = TokenBlocks.from_tokens(old_source, previous_tokens)
+        source = "".join((old_source[:edit_offset], inserted_text, old_source[edit_offset + removed_len:]))
+        shift = len(inserted_text) - removed_len
+        inserted_end = edit_offset + len(inserted_text)
+        count = len(previous_tokens)
+
+        # Restart one token before the first token that reaches the edit,
+        # so a neighbour that merges with the new text ("<" + "=") is redone.
+        # With no token before the edit, restart from the top of the source.
+        first = previous_tokens.index_of_end(edit_offset)
+        hook = _tokenize_hook
+        if hook is not None:
+            started = perf_counter()
+        scanner = Lexer(source, engine=self.engine)
+        if first > 0:
+            first -= 1
+            restart = previous_tokens[first]
+            scanner.pos, scanner.line, scanner.column = restart.start, restart.line, restart.column
+        begin = scanner.pos
+
+        # Scan a growing window until a new token past the edit lines up
+        # with an old one: from there on both streams agree, only shifted
+        resync = count
+        checked = 0
+        window = RELEX_WINDOW
+        while resync == count and scanner.pos < len(source):
+            if self.deadline is not None and monotonic() >= self.deadline:
+                self.truncated = True
+                break
+            stop = inserted_end + window
+            if self.deadline is not None and scanner.pos + DEADLINE_CHECK_CHARS < stop:
+                # a large insert is scanned in pieces so the clock gets checked
+                stop = scanner.pos + DEADLINE_CHECK_CHARS
+            else:
+                window *= 2
+            scanner.tokenize_regex(stop=stop)
+            new_tokens = scanner.tokens
+            while checked < len(new_tokens) and resync == count:
+                token = new_tokens[checked]
+                if token.start >= inserted_end:
+                    old_index = previous_tokens.index_of_start(token.start - shift, first)
+                    if old_index < count:
+                        old = previous_tokens[old_index]
+                        if old.start + shift == token.start and old.end + shift == token.end and old.type == token.type:
+                            resync = old_index
+                            line_shift = token.line - old.line
+                            column_shift = token.column - old.column
+                            sync_line = old.line
+                            continue
+                checked += 1
+        if hook is not None:
+            hook(self, scanner.tokens, perf_counter() - started, scanner.pos - begin)
+        if self.truncated:
+            return None, previous_tokens
+
+        inserted = scanner.tokens[:checked]
+        if resync < count:
+            # the end-of-source position moves like the reused tail
+            if self.line == sync_line:
+                self.column += column_shift
+            self.line += line_shift
+            previous_tokens.replace(first, resync, inserted, source, shift, line_shift, column_shift, sync_line)
+        else:
+            self.line, self.column = scanner.line, scanner.column
+            previous_tokens.replace(first, resync, inserted, source)
+
+        self.source = source
+        self.tokens = previous_tokens
+        self.pos = len(source)
+        return TokenDelta(first, resync - first, inserted), previous_tokens
+
+    # ==================== STREAMING ====================
+    def iter_batches(self, window=STREAM_CHUNK_SIZE):
+        # Tokenize an in-memory source about `window` characters at a time,
+        # yielding each batch of tokens as soon as it is scanned. With a
+        # deadline, stops between batches once it has passed (truncated).
+        hook = _tokenize_hook
+        while self.pos < len(self.source):
+            if self.deadline is not None and monotonic() >= self.deadline:
+                self.truncated = True
+                return
+            self.tokens = []
+            if hook is None:
+                self.tokenize_regex(stop=self.pos + window)
+            else:
+                begin = self.pos
+                started = perf_counter()
+                self.tokenize_regex(stop=self.pos + window)
+                hook(self, self.tokens, perf_counter() - started, self.pos - begin)
+            yield self.tokens
+
+    @classmethod
+    def iter_tokens(cls, stream, chunk_size=STREAM_CHUNK_SIZE):
+        # Read stream (text or binary) in chunks and yield each token as soon
+        # as it is complete. Only the unfinished tail of the last chunk is
+        # kept, so memory stays around chunk_size plus the longest token.
+        # Yielded tokens carry their value and absolute stream offsets.
+        chunk = stream.read(chunk_size)
+        lexer = cls(chunk)
+        final = not chunk
+        base = 0
+        read_size = chunk_size
+
+        while True:
+            lexer.tokenize_regex(final=final)
+            for token in lexer.tokens:
+                yield Token(token.type, token.value, token.line, token.column,
+                            base + token.start, base + token.end)
+            lexer.tokens = []
+            if final:
+                return
+
+            # A token longer than the buffer: read bigger pieces so that
+            # rescanning it stays linear overall
+            consumed = lexer.pos
+            read_size = chunk_size if consumed else read_size * 2
+            chunk = stream.read(read_size)
+            lexer.source = lexer.source[consumed:] + chunk
+            lexer.pos = 0
+            base += consumed
+            final = not chunk
+
+# ==================== FIRST-CHARACTER DISPATCH ====================
+def build_first_char_handlers():
+    # handler(lexer, ch) for every Latin-1 character, in the order the
+    # token kinds take precedence; anything past Latin-1 uses lex_wide_char
+    def without_char(method):
+        return lambda lexer, ch: method(lexer)
+
+    handlers = []
+    for code in range(256):
+        ch = chr(code)
+        if ch == '\n':
+            handler = without_char(Lexer.lex_newline)
+        elif ch == '#':
+            handler = without_char(Lexer.lex_preprocessor)
+        elif ch == '/':
+            handler = Lexer.lex_slash
+        elif ch.isdigit():
+            handler = without_char(Lexer.lex_number)
+        elif ch.isalpha() or ch == '_':
+            handler = without_char(Lexer.lex_identifier)
+        elif ch in ('"', "'"):
+            handler = Lexer.lex_string
+        elif ch in SINGLE_OPS or ch in TWO_CHAR_OPS:
+            handler = Lexer.lex_operator
+        elif ch in DELIMITERS:
+            handler = Lexer.lex_delimiter
+        else:
+            handler = Lexer.lex_unknown
+        handlers.append(handler)
+    return tuple(handlers)
+
+
+FIRST_CHAR_HANDLERS = build_first_char_handlers()
+
 
 # ==================== DISPLAY RESULTS ====================
 def display_tokens(tokens, source_name="input"):
@@ -259,13 +1206,26 @@ def display_tokens(tokens, source_name="input"):
     # Count by type
     type_count = {}
 
-    for token in tokens:
-        if token.type == "NEWLINE":
-            continue  # skip newline tokens in display
-        print(token)
-        type_count[token.type] = type_count.get(token.type, 0) + 1
+    if isinstance(tokens, TokenBuffer):
+        # read the columns directly instead of building Token objects
+        for token_type, value, line, column in tokens.rows():
+            if token_type == "NEWLINE":
+                continue  # skip newline tokens in display
+            print(format_token_row(token_type, value, line, column))
+        type_count = tokens.type_counts()
+        type_count.pop("NEWLINE", None)
+    else:
+        for token in tokens:
+            if token.type == "NEWLINE":
+                continue  # skip newline tokens in display
+            print(token)
+            type_count[token.type] = type_count.get(token.type, 0) + 1
 
     print("+" + "=" * 68 + "+")
+    display_summary(type_count)
+
+
+def display_summary(type_count):
     print(f"| {'TOTAL TOKENS:':<16}   {sum(type_count.values()):<47} |")
     print("+" + "-" * 68 + "+")
 
@@ -277,22 +1237,137 @@ def display_tokens(tokens, source_name="input"):
     print("+" + "=" * 68 + "+")
 
 
+# ==================== MULTI-FILE MODE ====================
+# Extensions picked up when a directory is given
+SOURCE_EXTENSIONS = (".c", ".h", ".cc", ".cpp", ".hpp", ".py")
+
+# Small files are sent to workers in batches of about this many bytes
+BATCH_BYTES = 1 << 20
+BATCH_FILES = 256
+
+
+def collect_files(patterns, extensions=SOURCE_EXTENSIONS):
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(tuple(extensions)):
+                        yield os.path.join(root, name)
+        elif glob.has_magic(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path):
+                    yield path
+        else:
+            yield pattern
+
+
+def batch_files(paths, batch_bytes=BATCH_BYTES, batch_files=BATCH_FILES):
+    batch, size = [], 0
+    for path in paths:
+        try:
+            file_size = os.path.getsize(path)
+        except OSError:
+            file_size = 0  # reported by the worker
+        if batch and (size + file_size > batch_bytes or len(batch) >= batch_files):
+            yield batch
+            batch, size = [], 0
+        batch.append(path)
+        size += file_size
+    if batch:
+        yield batch
+
+
+def tokenize_files(paths):
+    # Worker: returns (path, token counts by type, error) for each file.
+    # Counts come straight from the TokenBuffer, so no Token objects are built.
+    results = []
+    for path in paths:
+        try:
+            lexer = Lexer.from_path(path, mmap=True, columnar=True)
+            counts = lexer.tokenize().type_counts()
+            lexer.close()
+            counts.pop("NEWLINE", None)
+            results.append((path, counts, None))
+        except OSError as e:
+            results.append((path, {}, e.strerror or str(e)))
+    return results
+
+
+def iter_file_results(paths, jobs=None):
+    # Yield per-file results in completion order
+    batches = batch_files(paths)
+    if jobs == 1:
+        for batch in batches:
+            yield from tokenize_files(batch)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(tokenize_files, batch) for batch in batches]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def display_file_results(results):
+    print()
+    print("+" + "=" * 68 + "+")
+    print("|" + "  LEXICAL ANALYZER - MULTI-FILE OUTPUT".center(68) + "|")
+    print("+" + "=" * 68 + "+")
+
+    type_count = {}
+    files = failed = 0
+    for path, counts, error in results:
+        files += 1
+        if error:
+            failed += 1
+            print(f"  [ERROR] {path}: {error}")
+            continue
+        print(f"  [+] {path:<52} {sum(counts.values()):>8}")
+        for ttype, count in counts.items():
+            type_count[ttype] = type_count.get(ttype, 0) + count
+
+    print("+" + "=" * 68 + "+")
+    print(f"| {'FILES:':<16}   {f'{files} ({failed} failed)':<47} |")
+    display_summary(type_count)
+
+
 # ==================== MAIN ====================
 def main():
-    if len(sys.argv) >= 2:
+    parser = argparse.ArgumentParser(description="Lexical analyzer (no AI)")
+    parser.add_argument("paths", nargs="*", help="file, directory or glob; none starts interactive mode")
+    parser.add_argument("--mmap", action="store_true", help="scan files through a memory map")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes for multi-file mode")
+    parser.add_argument("--ext", action="append", help=f"extension to collect from directories (default: {' '.join(SOURCE_EXTENSIONS)})")
+    args = parser.parse_args()
+    use_mmap = args.mmap
+
+    single_file = (len(args.paths) == 1 and not os.path.isdir(args.paths[0])
+                   and not glob.has_magic(args.paths[0]))
+
+    if args.paths and not single_file:
+        # ---------- MULTI-FILE MODE ----------
+        paths = collect_files(args.paths, args.ext or SOURCE_EXTENSIONS)
+        display_file_results(iter_file_results(paths, args.jobs))
+
+    elif single_file:
         # ---------- FILE MODE ----------
-        filename = sys.argv[1]
+        filename = args.paths[0]
         try:
-            with open(filename, 'r') as f:
-                source = f.read()
+            if use_mmap:
+                lexer = Lexer.from_path(filename, mmap=True, columnar=True)
+            else:
+                f = open(filename, 'r')
             print(f"\n[*] Reading file: {filename}")
         except FileNotFoundError:
             print(f"\n[ERROR] File '{filename}' not found!")
             sys.exit(1)
 
-        lexer = Lexer(source)
-        tokens = lexer.tokenize()
-        display_tokens(tokens, filename)
+        if use_mmap:
+            display_tokens(lexer.tokenize(), filename)
+            lexer.close()
+        else:
+            # tokens are streamed, so the whole file is never held in memory
+            with f:
+                display_tokens(Lexer.iter_tokens(f), filename)
 
     else:
         # ---------- INTERACTIVE MODE ----------
@@ -334,7 +1409,7 @@ def main():
                 print(f"\n  [ERROR] File '{filename}' not found!")
                 sys.exit(1)
 
-            lexer = Lexer(source)
+            lexer = Lexer(source, columnar=True)
             tokens = lexer.tokenize()
             display_tokens(tokens, filename)
 
@@ -0,0 +1,153 @@
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from ai_cache import open_cache
+from ai_prompt import PROMPT_TOKEN_BUDGET
+
+# ============================================================
+#  BATCH ANALYSIS (shared by lexer_ai.py / lexer_olama.py)
+# ============================================================
+DEFAULT_EXTENSIONS = (".c", ".h", ".cc", ".cpp", ".hpp", ".py")
+SKIP_DIRS = {".git", ".hg", ".svn", "__pycache__", "node_modules", "venv", ".venv", "build", "dist"}
+DEFAULT_REPORT = "ai_report.jsonl"
+
+
+def iter_source_files(paths, extensions=DEFAULT_EXTENSIONS):
+    # Files given by name are always included; directories are walked
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith("."))
+            for name in sorted(files):
+                if name.endswith(extensions):
+                    yield os.path.join(root, name)
+
+
+def analyze_file(ai, lexer_class, path):
+    # Runs on a worker thread; failures become the record's "error" field
+    started = time.perf_counter()
+    record = {"path": path}
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            source = f.read()
+        lexer = lexer_class(source)
+        tokens = lexer.tokenize()
+        record["tokens"] = len(tokens)
+        record["lexer_errors"] = lexer.errors
+        answer, cached, digest = ai.analyze_batch(source, tokens, lexer.errors)
+        record["prompt"] = digest.to_dict()
+        record["analysis"] = answer
+        record["cached"] = cached
+        record["error"] = None
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def load_finished(report_path):
+    # Paths the report already holds a successful record for (failed ones are
+    # retried), and whether its last line was cut short by a stopped run
+    finished = set()
+    line = "\n"
+    try:
+        with open(report_path, "r", encoding="utf-8") as report:
+            for line in report:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and not record.get("error") and "path" in record:
+                    finished.add(record["path"])
+    except FileNotFoundError:
+        pass
+    return finished, not line.endswith("\n")
+
+
+def run_batch(ai, lexer_class, paths, report_path, jobs, extensions=DEFAULT_EXTENSIONS, fresh=False):
+    """Analyze every file with at most `jobs` AI requests in flight.
+
+    Records are appended to the JSONL report in completion order, so a
+    long run can be followed while it is going. Files the report already
+    has a successful record for are skipped, so an interrupted run picks
+    up where it stopped; fresh=True starts a new report instead.
+    """
+    files = list(iter_source_files(paths, extensions))
+    if not files:
+        print("  [!] No matching source files found.")
+        return {"files": 0, "failed": 0, "cached": 0, "seconds": 0.0}
+    cut_short = False
+    if not fresh:
+        finished, cut_short = load_finished(report_path)
+        todo = [path for path in files if path not in finished]
+        if len(todo) < len(files):
+            print(f"  [*] Skipping {len(files) - len(todo)} files already in {report_path}")
+        files = todo
+        if not files:
+            print("  [+] Every file is already in the report.")
+            return {"files": 0, "failed": 0, "cached": 0, "seconds": 0.0}
+
+    # one keep-alive connection per worker instead of reconnecting
+    ai.http.max_idle_per_host = max(ai.http.max_idle_per_host, jobs)
+    print(f"  [*] Analyzing {len(files)} files with {jobs} concurrent requests...")
+    print(f"  [*] Report: {report_path}\n")
+
+    started = time.perf_counter()
+    failed = cached = 0
+    with open(report_path, "w" if fresh else "a", encoding="utf-8") as report, ThreadPoolExecutor(max_workers=jobs) as pool:
+        if cut_short:
+            report.write("\n")
+        futures = [pool.submit(analyze_file, ai, lexer_class, path) for path in files]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            report.write(json.dumps(record, ensure_ascii=False) + "\n")
+            report.flush()
+            if record["error"]:
+                failed += 1
+                status = f"FAILED: {record['error']}"
+            elif record["cached"]:
+                cached += 1
+                status = "cached"
+            else:
+                status = f"{record['seconds']:.1f}s"
+            print(f"  [{done}/{len(files)}] {record['path']}  {status}")
+
+    elapsed = time.perf_counter() - started
+    print(f"\n  [+] {len(files)} files in {elapsed:.1f}s "
+          f"({len(files) / elapsed * 60:.1f} files/min) | {cached} cached | {failed} failed")
+    return {"files": len(files), "failed": failed, "cached": cached, "seconds": round(elapsed, 3)}
+
+
+def batch_main(make_assistant, lexer_class, default_jobs, argv=None):
+    # make_assistant(cache) -> AIAssistant; argv defaults to sys.argv[1:]
+    parser = argparse.ArgumentParser(description="Analyze many source files with the AI assistant")
+    parser.add_argument("--batch", nargs="+", metavar="PATH", required=True,
+                        help="files or directories to analyze")
+    parser.add_argument("--report", default=DEFAULT_REPORT, help=f"JSONL output (default {DEFAULT_REPORT})")
+    parser.add_argument("--jobs", type=int, default=default_jobs,
+                        help=f"AI requests in flight at once (default {default_jobs})")
+    parser.add_argument("--ext", default=",".join(DEFAULT_EXTENSIONS),
+                        help="comma-separated file extensions to include")
+    parser.add_argument("--budget", type=int, default=PROMPT_TOKEN_BUDGET,
+                        help=f"estimated source tokens per prompt (default {PROMPT_TOKEN_BUDGET})")
+    parser.add_argument("--no-cache", action="store_true", help="always ask the model")
+    parser.add_argument("--fresh", action="store_true",
+                        help="overwrite the report instead of skipping files it already has")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    ai = make_assistant(open_cache(["--no-cache"] if args.no_cache else []))
+    if not ai.enabled:
+        print("  [!] AI not available; nothing to do.")
+        return 1
+    ai.prompt_budget = args.budget
+    summary = run_batch(ai, lexer_class, args.batch, args.report, args.jobs, tuple(args.ext.split(",")),
+                        args.fresh)
+    return 1 if summary["failed"] else 0
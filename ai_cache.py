@@ -0,0 +1,117 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# ============================================================
+#  CONFIGURATION - AI RESPONSE CACHE (shared by lexer_ai.py / lexer_olama.py)
+# ============================================================
+CACHE_PATH = os.environ.get(
+    "LEXER_AI_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "lexer_ai", "responses.sqlite3"),
+)
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # answers older than a week are asked again
+CACHE_MAX_ENTRIES = 500
+CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Bump when the analyze/ask prompt templates change, so old answers are not reused
+PROMPT_VERSION = "2"
+
+
+class ResponseCache:
+    """SQLite cache of AI answers with a TTL and least-recently-used eviction."""
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS,
+                 max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # one connection shared between threads, serialized by self.lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_used REAL NOT NULL,
+            size INTEGER NOT NULL,
+            response TEXT NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    @staticmethod
+    def key(model, kind, *parts):
+        # kind: "analyze" or "ask"; parts: source, token summary, errors, question...
+        digest = hashlib.sha256()
+        digest.update(json.dumps([PROMPT_VERSION, model, kind], ensure_ascii=False).encode("utf-8"))
+        for part in parts:
+            data = part.encode("utf-8", "surrogatepass")
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if now - created > self.ttl:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, created, last_used, size, response) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, now, now, len(response.encode("utf-8", "surrogatepass")), response),
+            )
+            self.evict(now)
+
+    def evict(self, now):
+        # caller holds self.lock
+        self.db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        # keep the most recently used entries that fit both limits
+        kept = total = 0
+        stale = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY last_used DESC"):
+            kept += 1
+            total += size
+            if kept > self.max_entries or total > self.max_bytes:
+                stale.append((key,))
+        if stale:
+            self.db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        with self.lock:
+            count, size = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": size, "path": self.path}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def open_cache(argv=None):
+    # None when --no-cache is given or the cache file cannot be opened
+    argv = sys.argv[1:] if argv is None else argv
+    if "--no-cache" in argv:
+        print("  [*] Response cache disabled (--no-cache).")
+        return None
+    try:
+        cache = ResponseCache()
+    except (sqlite3.Error, OSError) as e:
+        print(f"  [!] Response cache unavailable ({e}); continuing without it.")
+        return None
+    print(f"  [*] Response cache: {cache.path}")
+    return cache
@@ -0,0 +1,177 @@
+import ssl
+import base64
+import threading
+import http.client
+from urllib.parse import unquote, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+# ============================================================
+#  KEEP-ALIVE HTTP CLIENT (shared by lexer_ai.py / lexer_olama.py)
+# ============================================================
+MAX_IDLE_PER_HOST = 4
+
+# What a failed connect, send or receive raises (timeouts are OSErrors too)
+CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+
+# Errors that mean a reused keep-alive connection had already been closed by
+# the server; the request never reached it, so it is safe to send again
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class PooledResponse:
+    """An HTTP response whose connection goes back to the pool once the body is read."""
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self):
+        try:
+            return self.response.read()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        # body lines as they arrive, for streaming (NDJSON) responses
+        try:
+            while True:
+                line = self.response.readline()
+                if not line:
+                    break
+                yield line
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        # only a fully read body leaves the connection ready for the next request
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, conn)
+        else:
+            self.response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    """Persistent http.client connections, kept idle per (scheme, host, port)."""
+
+    def __init__(self, timeout=60, max_idle_per_host=MAX_IDLE_PER_HOST, ssl_context=None, proxies=None):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.ssl_context = ssl_context
+        # {"http": url, "https": url}; None reads HTTP(S)_PROXY / NO_PROXY
+        # like urllib.request.urlopen does
+        self.proxies = proxies
+        self.idle = {}  # (scheme, host, port) -> [connection, ...]
+        self.lock = threading.Lock()
+        self.opened = 0  # connections created, for tests and diagnostics
+
+    def proxy_for(self, key):
+        # (host, port, Proxy-Authorization headers) of the proxy to go through, or None
+        scheme, host, _ = key
+        if self.proxies is None:
+            proxy = getproxies().get(scheme)
+            if proxy and proxy_bypass(host):
+                return None
+        else:
+            proxy = self.proxies.get(scheme)
+        if not proxy:
+            return None
+        parts = urlsplit(proxy if "//" in proxy else "http://" + proxy)
+        headers = {}
+        if parts.username is not None:
+            credentials = f"{unquote(parts.username)}:{unquote(parts.password or '')}"
+            headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+        return parts.hostname, parts.port or 80, headers
+
+    def connect(self, key, timeout, proxy=None):
+        scheme, host, port = key
+        self.opened += 1
+        if scheme == "https":
+            context = self.ssl_context or ssl.create_default_context()
+            if proxy is None:
+                return http.client.HTTPSConnection(host, port, timeout=timeout, context=context)
+            # TLS to the server inside a CONNECT tunnel through the proxy
+            proxy_host, proxy_port, proxy_headers = proxy
+            conn = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=timeout, context=context)
+            conn.set_tunnel(host, port, headers=proxy_headers)
+            return conn
+        if proxy is None:
+            return http.client.HTTPConnection(host, port, timeout=timeout)
+        return http.client.HTTPConnection(proxy[0], proxy[1], timeout=timeout)
+
+    def acquire(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            return idle.pop() if idle else None
+
+    def release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        # Returns a PooledResponse; read() or iterate it to free the connection
+        parts = urlsplit(url)
+        default_port = 443 if parts.scheme == "https" else 80
+        key = (parts.scheme, parts.hostname, parts.port or default_port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        timeout = self.timeout if timeout is None else timeout
+        proxy = self.proxy_for(key)
+        if proxy is not None and parts.scheme == "http":
+            # a plain HTTP proxy takes the absolute URL and its own credentials
+            path = f"http://{parts.netloc.rpartition('@')[2]}{path}"
+            if proxy[2]:
+                headers = {**(headers or {}), **proxy[2]}
+
+        while True:
+            conn = self.acquire(key)
+            reused = conn is not None
+            if not reused:
+                conn = self.connect(key, timeout, proxy)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if reused:
+                    continue  # the server dropped an idle connection: retry on another
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            return PooledResponse(self, key, conn, response)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
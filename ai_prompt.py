@@ -0,0 +1,224 @@
+import os
+import re
+
+# ============================================================
+#  PROMPT BUDGET (shared by lexer_ai.py / lexer_olama.py)
+# ============================================================
+# Estimated model tokens the source part of an analysis prompt may use
+PROMPT_TOKEN_BUDGET = int(os.environ.get("LEXER_AI_PROMPT_BUDGET") or 3000)
+CHARS_PER_MODEL_TOKEN = 4  # rough average for code with common tokenizers
+LINE_COST = 2  # the "123| " prefix kept lines get once the source is trimmed
+MARKER_COST = 8  # a "... lines a-b omitted ..." line
+COMMENT_KEEP_CHARS = 80  # compressed comments keep their first line, up to this
+STRING_KEEP_CHARS = 120  # longer literals (or unterminated strings) are cut
+ERROR_LINE = re.compile(r"\[Ln (\d+), Col \d+\]")
+BLOCK_STARTERS = ("def", "class")  # top-level chunk starts in brace-less sources
+
+
+def estimate_tokens(text):
+    return max(1, -(-len(text) // CHARS_PER_MODEL_TOKEN))
+
+
+class Chunk:
+    """A run of whole source lines: one top-level block plus what precedes it."""
+
+    def __init__(self, first_line, last_line, lines, errors):
+        self.first_line = first_line
+        self.last_line = last_line
+        self.lines = lines  # [(line number, compacted text), ...]
+        self.errors = errors  # lexer errors reported inside the chunk
+        self.cost = sum(estimate_tokens(text) + LINE_COST for _, text in lines)
+
+
+class SourceDigest:
+    """The source text to put in a prompt, and how much of it was trimmed."""
+
+    def __init__(self, text, trimmed, original_tokens, kept_tokens,
+                 chunks_total=1, chunks_kept=1, error_chunks=0, omitted_lines=0):
+        self.text = text
+        self.trimmed = trimmed
+        self.original_tokens = original_tokens
+        self.kept_tokens = kept_tokens
+        self.chunks_total = chunks_total
+        self.chunks_kept = chunks_kept
+        self.error_chunks = error_chunks
+        self.omitted_lines = omitted_lines
+
+    def summary(self):
+        if not self.trimmed:
+            return f"whole source sent (~{self.original_tokens:,} tokens)"
+        saved = 100 - 100 * self.kept_tokens // max(self.original_tokens, 1)
+        return (f"sent ~{self.kept_tokens:,} of ~{self.original_tokens:,} estimated tokens ({saved}% trimmed): "
+                f"{self.chunks_kept} of {self.chunks_total} chunks, {self.error_chunks} with lexer errors, "
+                f"{self.omitted_lines} lines omitted; comments and whitespace compressed")
+
+    def to_dict(self):
+        return {
+            "trimmed": self.trimmed,
+            "original_tokens": self.original_tokens,
+            "kept_tokens": self.kept_tokens,
+            "chunks_total": self.chunks_total,
+            "chunks_kept": self.chunks_kept,
+            "error_chunks": self.error_chunks,
+            "omitted_lines": self.omitted_lines,
+        }
+
+
+def compress_value(token):
+    value = token.value
+    if token.type == "COMMENT":
+        first = value.split("\n", 1)[0].rstrip()
+        if len(first) > COMMENT_KEEP_CHARS or first != value:
+            first = first[:COMMENT_KEEP_CHARS] + " ..."
+            if value.startswith("/*"):
+                first += " */"
+        return first
+    if token.type == "STRING" and (len(value) > STRING_KEEP_CHARS or "\n" in value):
+        return value[:STRING_KEEP_CHARS].replace("\n", "\\n") + " ..."
+    return value
+
+
+def compact_lines(source, tokens, keep_comments=True):
+    # Rebuilds each line from its tokens: indentation kept, runs of spaces and
+    # blank lines collapsed, comments compressed (or dropped)
+    line_starts = [0]
+    line_starts.extend(m.end() for m in re.finditer("\n", source))
+    lines = {}
+    prev_end = None
+    for token in tokens:
+        if token.type == "COMMENT" and not keep_comments:
+            continue
+        start = line_starts[token.line - 1] + token.column - 1
+        value = compress_value(token)
+        pieces = lines.get(token.line)
+        if pieces is None:
+            indent = source[line_starts[token.line - 1]:start]
+            lines[token.line] = pieces = [indent if not indent.strip() else ""]
+        elif start > prev_end:
+            pieces.append(" ")
+        pieces.append(value)
+        prev_end = start + len(token.value)
+    return [(line, "".join(pieces)) for line, pieces in lines.items()]
+
+
+def chunk_starts(tokens):
+    # First line of every top-level chunk: a new chunk begins on the line after
+    # a "}" that closes depth 0, and at column-1 def/class (or a decorator
+    # heading one) so brace-less sources are split too
+    starts = [1]
+    depth = 0
+    closed_line = None
+    head = prev = None
+    for token in tokens:
+        new_line = prev is None or token.line != prev.line
+        if new_line:
+            if closed_line is not None and token.line > closed_line:
+                starts.append(token.line)
+                closed_line = None
+            elif (depth == 0 and token.column == 1 and prev is not None
+                  and (token.value in BLOCK_STARTERS and token.type == "KEYWORD"
+                       or token.value == "@" and token.type == "OPERATOR")
+                  and not (head is not None and head.value == "@")
+                  and starts[-1] != token.line):
+                starts.append(token.line)
+            head = token
+        if token.type == "DELIMITER":
+            if token.value == "{":
+                depth += 1
+            elif token.value == "}" and depth:
+                depth -= 1
+                if depth == 0:
+                    closed_line = token.line
+        prev = token
+    return starts
+
+
+def split_chunk(chunk, limit, error_lines):
+    # Line groups of at most `limit` estimated tokens, so an oversized block
+    # still lets the part with the error in
+    pieces, group, cost = [], [], 0
+    for line, text in chunk.lines:
+        line_cost = estimate_tokens(text) + LINE_COST
+        if group and cost + line_cost > limit:
+            pieces.append(group)
+            group, cost = [], 0
+        group.append((line, text))
+        cost += line_cost
+    if group:
+        pieces.append(group)
+    return [
+        Chunk(group[0][0], group[-1][0], group, sum(error_lines.get(line, 0) for line, _ in group))
+        for group in pieces
+    ]
+
+
+def build_chunks(source, tokens, errors, budget, keep_comments=True):
+    error_lines = {}
+    for error in errors:
+        match = ERROR_LINE.match(error)
+        if match:
+            line = int(match.group(1))
+            error_lines[line] = error_lines.get(line, 0) + 1
+
+    lines = compact_lines(source, tokens, keep_comments)
+    starts = chunk_starts(tokens)
+    chunks = []
+    index = 0
+    for n, first in enumerate(starts):
+        stop = starts[n + 1] if n + 1 < len(starts) else None
+        group = []
+        while index < len(lines) and (stop is None or lines[index][0] < stop):
+            group.append(lines[index])
+            index += 1
+        if not group:
+            continue
+        count = sum(error_lines.get(line, 0) for line, _ in group)
+        chunk = Chunk(group[0][0], group[-1][0], group, count)
+        if chunk.cost > budget // 2:
+            chunks.extend(split_chunk(chunk, max(budget // 4, 1), error_lines))
+        else:
+            chunks.append(chunk)
+    return chunks
+
+
+def build_source_digest(source, tokens, errors, budget=PROMPT_TOKEN_BUDGET):
+    """Fit the source into about `budget` model tokens, estimated from lexer tokens.
+
+    Small sources are sent unchanged. Larger ones are compacted (comments and
+    whitespace compressed), split into top-level blocks, and the blocks with
+    lexer errors are kept first, then the rest in source order while they fit.
+    Kept lines carry their original numbers so error locations still match.
+    """
+    original = sum(estimate_tokens(token.value) for token in tokens) + source.count("\n")
+    if original <= budget:
+        return SourceDigest(source, False, original, original)
+
+    chunks = build_chunks(source, tokens, errors, budget)
+    if sum(chunk.cost for chunk in chunks) > budget:
+        # comments are the first thing to go when compressing is not enough
+        chunks = build_chunks(source, tokens, errors, budget, keep_comments=False)
+    kept = set()
+    used = 0
+    for n in sorted(range(len(chunks)), key=lambda n: (not chunks[n].errors, n)):
+        cost = chunks[n].cost + MARKER_COST
+        if used + cost <= budget:
+            kept.add(n)
+            used += cost
+
+    out = []
+    previous = -1
+    for n in sorted(kept) + [len(chunks)]:
+        if n > previous + 1:
+            out.append(f"... lines {chunks[previous + 1].first_line}-{chunks[n - 1].last_line} omitted ...")
+        if n < len(chunks):
+            out.extend(f"{line}| {text}" for line, text in chunks[n].lines)
+        previous = n
+    # code lines left out (blank and comment-only lines never count)
+    omitted = sum(len(chunk.lines) for n, chunk in enumerate(chunks) if n not in kept)
+
+    return SourceDigest(
+        "\n".join(out), True, original, used,
+        chunks_total=len(chunks), chunks_kept=len(kept),
+        error_chunks=sum(1 for n in kept if chunks[n].errors),
+        omitted_lines=omitted,
+    )
@@ -1,10 +1,495 @@
 import os
-from fastapi import FastAPI
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from operator import attrgetter
+from bisect import bisect_left, bisect_right
+from typing import List, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from Lexer_no_ai import Lexer  # reuse your lexer
+from Lexer_no_ai import Lexer, TokenBuffer, TokenBlocks, TOKEN_TYPE_NAMES, TOKEN_TYPE_IDS, LEXER_VERSION, set_tokenize_hook  # reuse your lexer
+from packed_tokens import pack_tokens, MEDIA_TYPE as PACKED_MEDIA_TYPE
 
-app = FastAPI(title="Lexer Simulator (no AI)")
+# Batch endpoint limits (override through the environment)
+MAX_BATCH_ITEMS = int(os.environ.get("LEXER_MAX_BATCH_ITEMS", "1000"))
+BATCH_WORKERS = int(os.environ.get("LEXER_BATCH_WORKERS", str(os.cpu_count() or 1)))
+# Batches smaller than this many characters are lexed in-process: IPC would cost more
+BATCH_INLINE_CHARS = int(os.environ.get("LEXER_BATCH_INLINE_CHARS", str(64 * 1024)))
+# Where /api/tokenize lexes: "process" (worker pool) or "thread" (threadpool)
+TOKENIZE_BACKENDS = ("process", "thread")
+TOKENIZE_BACKEND = os.environ.get("LEXER_TOKENIZE_BACKEND", "process")
+if TOKENIZE_BACKEND not in TOKENIZE_BACKENDS:
+    raise ValueError(f"LEXER_TOKENIZE_BACKEND must be one of {', '.join(TOKENIZE_BACKENDS)}")
+# Sources shorter than this are lexed inline whatever the backend: dispatch would cost more
+TOKENIZE_INLINE_CHARS = int(os.environ.get("LEXER_TOKENIZE_INLINE_CHARS", str(16 * 1024)))
+# Characters lexed per NDJSON chunk on /api/tokenize/stream
+STREAM_WINDOW_CHARS = int(os.environ.get("LEXER_STREAM_WINDOW_CHARS", str(16 * 1024)))
+# /api/tokenize response cache bounds
+CACHE_MAX_ENTRIES = int(os.environ.get("LEXER_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.environ.get("LEXER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Paged queries: token indexes kept per source hash, and page sizes
+INDEX_CACHE_ENTRIES = int(os.environ.get("LEXER_INDEX_CACHE_ENTRIES", "32"))
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("LEXER_INDEX_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+INDEX_TTL_SECONDS = float(os.environ.get("LEXER_INDEX_TTL_SECONDS", "300"))
+PAGE_DEFAULT_LIMIT = int(os.environ.get("LEXER_PAGE_DEFAULT_LIMIT", "1000"))
+PAGE_MAX_LIMIT = int(os.environ.get("LEXER_PAGE_MAX_LIMIT", "10000"))
+# Admission control for the /api/tokenize* endpoints
+MAX_BODY_BYTES = int(os.environ.get("LEXER_MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+MAX_IN_FLIGHT = int(os.environ.get("LEXER_MAX_IN_FLIGHT", str(2 * BATCH_WORKERS)))
+MAX_QUEUED = int(os.environ.get("LEXER_MAX_QUEUED", "64"))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("LEXER_QUEUE_TIMEOUT_SECONDS", "5"))
+RETRY_AFTER_SECONDS = int(os.environ.get("LEXER_RETRY_AFTER_SECONDS", "1"))
+# Open /ws/tokenize sessions; each may hold a source up to MAX_BODY_BYTES and its tokens
+MAX_WS_SESSIONS = int(os.environ.get("LEXER_MAX_WS_SESSIONS", "16"))
+# Lexing time allowed per request; past it the tokens so far are returned (0 = no limit)
+REQUEST_BUDGET_SECONDS = float(os.environ.get("LEXER_REQUEST_BUDGET_SECONDS", "2"))
+# LEXER_METRICS=0 turns off /metrics collection, including the Lexer.tokenize hook
+METRICS_ENABLED = os.environ.get("LEXER_METRICS", "1") != "0"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "lexer_request_seconds": ("histogram", "HTTP request latency by endpoint"),
+    "lexer_lex_seconds": ("histogram", "Time spent in Lexer.tokenize"),
+    "lexer_serialize_seconds": ("histogram", "Time spent turning tokens into a response body"),
+    "lexer_source_chars_total": ("counter", "Characters lexed by Lexer.tokenize"),
+    "lexer_tokens_total": ("counter", "Tokens emitted by Lexer.tokenize, by type"),
+    "lexer_errors_total": ("counter", "Error responses and failed batch items"),
+    "lexer_cache_hits_total": ("counter", "/api/tokenize response cache hits"),
+    "lexer_cache_misses_total": ("counter", "/api/tokenize response cache misses"),
+    "lexer_cache_bytes": ("gauge", "Bytes held by the response cache"),
+    "lexer_pool_queue_depth": ("gauge", "Jobs submitted to the worker pool and not finished"),
+    "lexer_requests_in_flight": ("gauge", "Tokenize requests holding an admission slot"),
+    "lexer_requests_waiting": ("gauge", "Tokenize requests waiting for an admission slot"),
+    "lexer_ws_sessions": ("gauge", "Open /ws/tokenize editing sessions"),
+    "lexer_truncated_total": ("counter", "Results cut short by the request time budget"),
+    "lexer_rejected_total": ("counter", "Requests turned away by admission control, by status"),
+}
+
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Worker processes record into their own copy and hand it back with drain();
+    the server adds it to its own with merge().
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+
+    def drain(self):
+        with self.lock:
+            state = (self.counters, self.histograms)
+            self.counters, self.histograms = {}, {}
+        return state
+
+    def merge(self, state):
+        counters, histograms = state
+        with self.lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, values in histograms.items():
+                histogram = self.histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    def render(self, extra=()):
+        # extra: (name, labels dict, value) samples read at scrape time
+        samples = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), values in self.histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), values):
+                    cumulative += count
+                    lines.append((name + "_bucket", labels + (("le", str(bound)),), cumulative))
+                lines.append((name + "_sum", labels, values[-1]))
+                lines.append((name + "_count", labels, cumulative))
+        for name, labels, value in extra:
+            samples.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+
+        out = []
+        for name in sorted(samples):
+            kind, help_text = METRIC_HELP[name]
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples[name]:
+                if labels:
+                    label_text = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels)
+                    sample = f"{sample}{{{label_text}}}"
+                out.append(f"{sample} {value}")
+        return "\n".join(out) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+get_token_type = attrgetter("type")
+
+def record_tokenize(lexer, tokens, seconds, chars):
+    # Lexer scan hook: runs in whichever process did the lexing. chars is
+    # what the scan covered, less than the source when it was truncated
+    metrics.observe("lexer_lex_seconds", seconds)
+    metrics.inc("lexer_source_chars_total", chars)
+    if isinstance(tokens, TokenBuffer):
+        counts = tokens.type_counts()
+    else:
+        counts = Counter(map(get_token_type, tokens))
+    for token_type, count in counts.items():
+        metrics.inc("lexer_tokens_total", count, type=token_type)
+
+if metrics.enabled:
+    set_tokenize_hook(record_tokenize)
+
+
+class ResponseCache:
+    """LRU of serialized response bodies, bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(source, *options):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("\0".join((LEXER_VERSION,) + options).encode("utf-8") + b"\0")
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return digest.digest()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self.entries[key] = body
+            self.bytes += len(body)
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+            }
+
+
+response_cache = ResponseCache()
+
+
+class TokenIndexCache:
+    """Short-lived columnar token lists per source hash, for serving pages by slicing."""
+
+    def __init__(self, max_entries=INDEX_CACHE_ENTRIES, ttl=INDEX_TTL_SECONDS, max_bytes=INDEX_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, TokenBuffer, size)
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def size(tokens):
+        # the token arrays plus the source they slice values from
+        arrays = (tokens.types, tokens.starts, tokens.ends, tokens.lines, tokens.columns)
+        return sum(a.buffer_info()[1] * a.itemsize for a in arrays) + len(tokens.source)
+
+    def evict(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def get(self, key):
+        # each read extends the entry's lifetime
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < now:
+                self.evict(key)
+                return None
+            self.entries[key] = (now + self.ttl, entry[1], entry[2])
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, tokens):
+        size = self.size(tokens)
+        if size > self.max_bytes:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if key in self.entries:
+                self.evict(key)
+            self.entries[key] = (now + self.ttl, tokens, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.evict(next(iter(self.entries)))
+            for stale in [k for k, (expires, _, _) in self.entries.items() if expires < now]:
+                self.evict(stale)
+
+
+token_index_cache = TokenIndexCache()
+
+class AdmissionGate:
+    """Bounds how many tokenize requests run at once and how many may wait for a slot."""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queued=MAX_QUEUED, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.slots = None  # created on first use, inside the running event loop
+
+    async def acquire(self):
+        # Returns None once a slot is held, or (status, detail) to reject with
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+        if self.slots.locked():
+            if self.waiting >= self.max_queued:
+                return 429, "Too many requests waiting; retry later"
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return 503, "No worker became free in time; retry later"
+            finally:
+                self.waiting -= 1
+        else:
+            await self.slots.acquire()
+        self.in_flight += 1
+        return None
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+
+admission_gate = AdmissionGate()
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class AdmissionControl:
+    """ASGI middleware: rejects oversized bodies and admits requests through the gate."""
+
+    def __init__(self, app, gate, prefix="/api/tokenize", max_body=MAX_BODY_BYTES):
+        self.app = app
+        self.gate = gate
+        self.prefix = prefix
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_body:
+            await self.reject(scope, receive, send, 413, f"Request body over {self.max_body} bytes")
+            return
+        rejection = await self.gate.acquire()
+        if rejection is not None:
+            await self.reject(scope, receive, send, *rejection, retry=True)
+            return
+
+        # Chunked bodies carry no Content-Length: count them as they arrive.
+        # FastAPI turns errors raised while reading the body into a 400, so
+        # that response is dropped and replaced with a 413.
+        received = 0
+        too_large = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > self.max_body:
+                too_large = True
+                raise BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if too_large and not started:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except BodyTooLarge:
+            pass
+        finally:
+            self.gate.release()
+        if too_large and not started:
+            await self.reject(scope, receive, send, 413, f"Request body over {self.max_body} bytes")
+
+    async def reject(self, scope, receive, send, status, detail, retry=False):
+        metrics.inc("lexer_rejected_total", status=str(status))
+        headers = {"Retry-After": str(RETRY_AFTER_SECONDS)} if retry else None
+        await JSONResponse({"detail": detail}, status_code=status, headers=headers)(scope, receive, send)
+
+
+def request_deadline():
+    # time.monotonic() is system-wide, so workers can compare against it too
+    if REQUEST_BUDGET_SECONDS <= 0:
+        return None
+    return time.monotonic() + REQUEST_BUDGET_SECONDS
+
+def truncation_error(lexer):
+    metrics.inc("lexer_truncated_total")
+    return (f"Time budget of {REQUEST_BUDGET_SECONDS:g}s exceeded: lexed {lexer.pos} of "
+            f"{len(lexer.source)} characters, tokens are partial")
+
+_worker_pool = None
+# Jobs handed to the worker pool (by run_pooled) and not finished yet.
+# Only touched from the event loop, so no lock is needed.
+_pool_pending = 0
+_pool_completed = 0
+
+def get_worker_pool():
+    global _worker_pool
+    if _worker_pool is None:
+        _worker_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=reset_worker_metrics)
+    return _worker_pool
+
+def discard_worker_pool(pool):
+    global _worker_pool
+    if _worker_pool is pool:
+        _worker_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def reset_worker_metrics():
+    # Pool initializer: a module-level function, so it pickles under spawn
+    # (a bound metrics.drain would drag the Metrics lock along)
+    metrics.drain()
+
+def warm_worker():
+    # Imports the lexer and compiles its patterns in the worker
+    Lexer("int x = 0;").tokenize()
+    metrics.drain()
+    return os.getpid()
+
+def run_in_worker(fn, *args):
+    # Returns fn's result with the metrics recorded while computing it
+    return fn(*args), metrics.drain()
+
+def merge_worker_result(outcome):
+    result, state = outcome
+    metrics.merge(state)
+    return result
+
+async def run_pooled(fn, *args):
+    # Every job sent to the worker pool goes through here so queue_depth sees it
+    global _pool_pending, _pool_completed
+    _pool_pending += 1
+    try:
+        for attempt in range(2):
+            pool = get_worker_pool()
+            try:
+                outcome = await asyncio.wrap_future(pool.submit(run_in_worker, fn, *args))
+                return merge_worker_result(outcome)
+            except BrokenProcessPool:
+                # A worker died (OOM-killed, say): the executor is unusable from
+                # now on, so replace it and give the job one more try
+                discard_worker_pool(pool)
+        raise HTTPException(status_code=503, detail="Worker pool failed; try again")
+    finally:
+        _pool_pending -= 1
+        _pool_completed += 1
+
+@asynccontextmanager
+async def lifespan(app):
+    if TOKENIZE_BACKEND == "process" or BATCH_WORKERS > 1:
+        # Start every worker before the first request instead of during it
+        pool = get_worker_pool()
+        await asyncio.gather(*(asyncio.wrap_future(pool.submit(warm_worker)) for _ in range(BATCH_WORKERS)))
+    yield
+    global _worker_pool
+    if _worker_pool is not None:
+        _worker_pool.shutdown(cancel_futures=True)
+        _worker_pool = None
+
+app = FastAPI(title="Lexer Simulator (no AI)", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_request(request, call_next):
+    if not metrics.enabled:
+        return await call_next(request)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # label by route template, not raw path, to keep label values bounded
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        metrics.observe("lexer_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+        if status >= 400:
+            metrics.inc("lexer_errors_total", endpoint=endpoint, status=str(status))
+
+# added after record_request so rejections skip it and are counted on their own
+app.add_middleware(AdmissionControl, gate=admission_gate)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten to your domain in prod
@@ -16,17 +501,361 @@ app.add_middleware(
 class SourceRequest(BaseModel):
     source: str
 
-def tokens_to_dict(tokens):
-    return [
-        {"type": t.type, "value": t.value, "line": t.line, "column": t.column}
-        for t in tokens
-    ]
+class NamedSource(BaseModel):
+    name: str
+    source: str
 
-@app.post("/api/tokenize")
-def tokenize(req: SourceRequest):
-    lexer = Lexer(req.source)
+class BatchRequest(BaseModel):
+    items: List[NamedSource]
+
+def tokens_to_dict(tokens, first=0, stop=None):
+    # tokens[first:stop]; stop=None runs to the end
+    if isinstance(tokens, TokenBuffer):
+        return [
+            {"type": token_type, "value": value, "line": line, "column": column}
+            for token_type, value, line, column in tokens.rows(first, stop)
+        ]
+    if first or stop is not None:
+        tokens = tokens[first:stop]
+    return [token_to_dict(t) for t in tokens]
+
+def token_to_dict(t):
+    return {"type": t.type, "value": t.value, "line": t.line, "column": t.column}
+
+def tokens_to_compact(tokens, first=0, stop=None):
+    # Columnar payload read straight from the TokenBuffer arrays: a type-name
+    # table plus parallel arrays. Values are source[starts[i]:ends[i]].
+    window = slice(first, stop)
+    return {
+        "format": "compact",
+        "types": TOKEN_TYPE_NAMES,
+        "type_ids": tokens.types[window].tolist(),
+        "starts": tokens.starts[window].tolist(),
+        "ends": tokens.ends[window].tolist(),
+        "lines": tokens.lines[window].tolist(),
+        "columns": tokens.columns[window].tolist(),
+    }
+
+def tokenize_source(source, deadline=None):
+    lexer = Lexer(source, columnar=True, deadline=deadline)
     tokens = lexer.tokenize()
     return {
         "tokens": tokens_to_dict(tokens),
-        "errors": [],  # Lexer_no_ai currently doesn’t emit errors; extend if needed
+        "errors": [truncation_error(lexer)] if lexer.truncated else [],
     }
+
+def tokenize_named(items, deadline=None):
+    # Runs in a worker process: one call per chunk of (name, source) pairs
+    results = []
+    for name, source in items:
+        try:
+            result = tokenize_source(source, deadline)
+        except Exception as e:
+            metrics.inc("lexer_errors_total", endpoint="/api/tokenize/batch", status="item")
+            result = {"tokens": [], "errors": [f"{type(e).__name__}: {e}"]}
+        results.append({"name": name, **result})
+    return results
+
+def json_bytes(payload):
+    # same encoding FastAPI's JSONResponse uses
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def render_source(source, response_format, deadline=None):
+    # Lex and serialize in one call so a worker process sends back finished bytes.
+    # Returns (body, complete); an incomplete body must not be cached.
+    lexer = Lexer(source, columnar=True, deadline=deadline)
+    tokens = lexer.tokenize()
+    errors = [truncation_error(lexer)] if lexer.truncated else []
+    started = time.perf_counter()
+    if response_format == "packed":
+        body = pack_tokens(tokens, errors, lexer.truncated)
+    elif response_format == "compact":
+        body = json_bytes({**tokens_to_compact(tokens), "errors": errors})
+    else:
+        body = json_bytes({"tokens": tokens_to_dict(tokens), "errors": errors})
+    metrics.observe("lexer_serialize_seconds", time.perf_counter() - started, format=response_format)
+    return body, not lexer.truncated
+
+async def render_offloaded(source, response_format, deadline=None):
+    if TOKENIZE_BACKEND == "thread":
+        return await run_in_threadpool(render_source, source, response_format, deadline)
+    return await run_pooled(render_source, source, response_format, deadline)
+
+def encode_cursor(key, first, stop, limit):
+    return f"{key.hex()}.{first}.{stop}.{limit}"
+
+def decode_cursor(cursor):
+    try:
+        key, first, stop, limit = cursor.split(".")
+        return bytes.fromhex(key), int(first), int(stop), int(limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+
+def line_range(tokens, line_start, line_end):
+    # Token indexes [first, stop) of the tokens on lines line_start..line_end,
+    # including a multi-line token (block comment) that starts above the range
+    lines = tokens.lines
+    first = 0 if line_start is None else bisect_left(lines, line_start)
+    stop = len(tokens) if line_end is None else bisect_right(lines, line_end)
+    if line_start is not None and first > 0:
+        before = first - 1
+        if tokens.types[before] != TOKEN_TYPE_IDS["NEWLINE"] and \
+                lines[before] + tokens.source.count("\n", tokens.starts[before], tokens.ends[before]) >= line_start:
+            first = before
+    return first, max(first, stop)
+
+def page_payload(tokens, key, first, stop, limit, response_format, errors=()):
+    # Tokens first..min(stop, first + limit) - 1, plus a cursor for the rest
+    end = min(stop, first + limit)
+    if response_format == "compact":
+        payload = tokens_to_compact(tokens, first, end)
+    else:
+        payload = {"tokens": tokens_to_dict(tokens, first, end)}
+    payload["errors"] = list(errors)
+    # a truncated index is not cached, so there is nothing to continue from
+    more = end < stop and not errors
+    payload["page"] = {
+        "offset": first,
+        "count": end - first,
+        "total": len(tokens),
+        "next_cursor": encode_cursor(key, end, stop, limit) if more else None,
+    }
+    return payload
+
+async def get_token_index(source, deadline=None):
+    # Returns (key, tokens, errors); only complete indexes are cached
+    key = ResponseCache.key(source)
+    tokens = token_index_cache.get(key)
+    if tokens is not None:
+        return key, tokens, []
+    lexer = Lexer(source, columnar=True, deadline=deadline)
+    if len(source) < TOKENIZE_INLINE_CHARS:
+        tokens = lexer.tokenize()
+    else:
+        tokens = await run_in_threadpool(lexer.tokenize)
+    if lexer.truncated:
+        return key, tokens, [truncation_error(lexer)]
+    token_index_cache.put(key, tokens)
+    return key, tokens, []
+
+@app.post("/api/tokenize")
+async def tokenize(
+    req: SourceRequest,
+    response_format: Optional[Literal["verbose", "compact", "packed"]] = Query(None, alias="format"),
+    offset: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT),
+    line_start: Optional[int] = Query(None, ge=1),
+    line_end: Optional[int] = Query(None, ge=1),
+    accept: Optional[str] = Header(None),
+):
+    # Without ?format=, "Accept: application/octet-stream" asks for the packed stream
+    if response_format is None:
+        response_format = "packed" if accept and PACKED_MEDIA_TYPE in accept else "verbose"
+    media_type = PACKED_MEDIA_TYPE if response_format == "packed" else "application/json"
+
+    if offset is not None or limit is not None or line_start is not None or line_end is not None:
+        if response_format == "packed":
+            raise HTTPException(status_code=400, detail="Paged queries return JSON; use format=verbose or compact")
+        # Paged query: slice the cached token index instead of returning everything.
+        # offset counts tokens from the start of the line range.
+        key, tokens, errors = await get_token_index(req.source, request_deadline())
+        first, stop = line_range(tokens, line_start, line_end)
+        first = min(first + (offset or 0), stop)
+        return page_payload(tokens, key, first, stop, limit or PAGE_DEFAULT_LIMIT, response_format, errors)
+
+    # Hits return the stored bytes: no lexing and no JSON encoding
+    key = ResponseCache.key(req.source, response_format)
+    body = response_cache.get(key)
+    if body is not None:
+        return Response(content=body, media_type=media_type, headers={"X-Cache": "HIT"})
+    deadline = request_deadline()
+    if len(req.source) < TOKENIZE_INLINE_CHARS:
+        body, complete = render_source(req.source, response_format, deadline)
+    else:
+        body, complete = await render_offloaded(req.source, response_format, deadline)
+    if complete:
+        response_cache.put(key, body)
+    return Response(content=body, media_type=media_type, headers={"X-Cache": "MISS"})
+
+@app.get("/api/tokenize/page")
+def tokenize_page(cursor: str, response_format: Literal["verbose", "compact"] = Query("verbose", alias="format")):
+    # Continues a paged query without resending the source
+    key, first, stop, limit = decode_cursor(cursor)
+    tokens = token_index_cache.get(key)
+    if tokens is None:
+        raise HTTPException(status_code=410, detail="Token index expired; POST the source again")
+    if not 0 <= first <= stop <= len(tokens) or not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail="Malformed cursor")
+    return page_payload(tokens, key, first, stop, limit, response_format)
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return response_cache.stats()
+
+@app.get("/api/workers/stats")
+def worker_stats():
+    # queue_depth counts jobs submitted to the pool and not yet finished,
+    # including the ones currently running on a worker
+    return {
+        "backend": TOKENIZE_BACKEND,
+        "workers": BATCH_WORKERS,
+        "inline_chars": TOKENIZE_INLINE_CHARS,
+        "queue_depth": _pool_pending,
+        "completed": _pool_completed,
+        "requests_in_flight": admission_gate.in_flight,
+        "requests_waiting": admission_gate.waiting,
+        "ws_sessions": _ws_sessions,
+    }
+
+@app.get("/metrics")
+def metrics_endpoint():
+    cache = response_cache.stats()
+    extra = [
+        ("lexer_cache_hits_total", {}, cache["hits"]),
+        ("lexer_cache_misses_total", {}, cache["misses"]),
+        ("lexer_cache_bytes", {}, cache["bytes"]),
+        ("lexer_pool_queue_depth", {}, _pool_pending),
+        ("lexer_requests_in_flight", {}, admission_gate.in_flight),
+        ("lexer_requests_waiting", {}, admission_gate.waiting),
+        ("lexer_ws_sessions", {}, _ws_sessions),
+    ]
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+def iter_ndjson(source, deadline=None):
+    # One JSON line per token, written a lexer batch at a time, then a
+    # final summary line. Only the current batch is ever held in memory.
+    # Past the deadline the stream ends early, with the summary saying so.
+    counts = {}
+    lexer = Lexer(source, deadline=deadline)
+    for tokens in lexer.iter_batches(STREAM_WINDOW_CHARS):
+        lines = []
+        for t in tokens:
+            counts[t.type] = counts.get(t.type, 0) + 1
+            lines.append(json.dumps({"type": t.type, "value": t.value, "line": t.line, "column": t.column}))
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+    errors = [truncation_error(lexer)] if lexer.truncated else []
+    summary = {"summary": {"tokens": sum(counts.values()), "counts": counts}, "errors": errors}
+    yield (json.dumps(summary) + "\n").encode("utf-8")
+
+@app.post("/api/tokenize/stream")
+def tokenize_stream(req: SourceRequest):
+    # the budget starts when the request arrives, not when streaming does
+    return StreamingResponse(iter_ndjson(req.source, request_deadline()), media_type="application/x-ndjson")
+
+@app.post("/api/tokenize/batch")
+async def tokenize_batch(req: BatchRequest):
+    if len(req.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(req.items)} items (max {MAX_BATCH_ITEMS})")
+    items = [(item.name, item.source) for item in req.items]
+    deadline = request_deadline()
+
+    if BATCH_WORKERS <= 1 or sum(len(source) for _, source in items) < BATCH_INLINE_CHARS:
+        return {"results": await run_in_threadpool(tokenize_named, items, deadline)}
+
+    # One chunk per worker keeps the number of IPC round-trips small
+    chunk_size = -(-len(items) // BATCH_WORKERS)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    outcomes = await asyncio.gather(*(run_pooled(tokenize_named, chunk, deadline) for chunk in chunks))
+    return {"results": [result for chunk in outcomes for result in chunk]}
+
+class EditSession:
+    """Source and token list of one WebSocket client, patched edit by edit."""
+
+    def __init__(self, source, deadline=None):
+        # relex() patches a TokenBlocks stream in place, so build it up front
+        self.lexer = Lexer(source, columnar=True, deadline=deadline)
+        tokens = self.lexer.tokenize()
+        if self.lexer.truncated:
+            # edits cannot be patched into a partial token stream
+            raise ValueError(truncation_error(self.lexer))
+        self.tokens = TokenBlocks.from_tokens(source, tokens)
+        self.version = 0
+
+    def edit(self, offset, delete, insert, deadline=None):
+        source = self.lexer.source
+        if not 0 <= offset <= len(source) or not 0 <= delete <= len(source) - offset:
+            raise ValueError(f"Edit out of range: offset {offset}, delete {delete}, length {len(source)}")
+        if len(source) - delete + len(insert) > MAX_BODY_BYTES:
+            raise ValueError(f"Source would exceed {MAX_BODY_BYTES} characters")
+        self.lexer.deadline = deadline
+        delta, self.tokens = self.lexer.relex(self.tokens, offset, delete, insert)
+        if delta is None:
+            # the session still holds the text from before this edit
+            metrics.inc("lexer_truncated_total")
+            raise ValueError(f"Time budget of {REQUEST_BUDGET_SECONDS:g}s exceeded; the edit was not applied")
+        self.version += 1
+        return delta
+
+    def full_message(self):
+        return {"type": "tokens", "version": self.version, "tokens": tokens_to_dict(self.tokens), "errors": []}
+
+    def delta_message(self, delta):
+        # Tokens after the replaced range are reused by the client. "tail" is
+        # the new position of the first of them: the client shifts lines by
+        # its line difference, and columns on that token's old line too.
+        after = delta.index + len(delta.inserted)
+        tail = None
+        if after < len(self.tokens):
+            tail = [self.tokens[after].line, self.tokens[after].column]
+        return {
+            "type": "delta",
+            "version": self.version,
+            "index": delta.index,
+            "removed": delta.removed,
+            "tokens": tokens_to_dict(delta.inserted),
+            "tail": tail,
+            "errors": [],
+        }
+
+# Open /ws/tokenize sessions; only touched from the event loop
+_ws_sessions = 0
+
+@app.websocket("/ws/tokenize")
+async def tokenize_session(websocket: WebSocket):
+    # Client messages:
+    #   {"type": "open", "source": "..."}                      -> full token list
+    #   {"type": "edit", "offset": o, "delete": d, "insert": "..."} -> changed range only
+    # Offsets count code points, like Python string indices. Lexing runs on
+    # the threadpool so a large document never stalls the event loop.
+    # AdmissionControl only sees HTTP requests, so sessions are capped here.
+    global _ws_sessions
+    await websocket.accept()
+    if _ws_sessions >= MAX_WS_SESSIONS:
+        metrics.inc("lexer_rejected_total", status="1013")
+        await websocket.close(code=1013, reason="Too many editing sessions; retry later")
+        return
+    _ws_sessions += 1
+    session = None
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                # characters <= UTF-8 bytes, so only long messages need encoding
+                if len(raw) > MAX_BODY_BYTES // 4 and len(raw.encode("utf-8")) > MAX_BODY_BYTES:
+                    raise ValueError(f"Message larger than {MAX_BODY_BYTES} bytes")
+                message = json.loads(raw)
+                if not isinstance(message, dict):
+                    raise ValueError("Messages must be JSON objects")
+                if message.get("type") == "open":
+                    session = None
+                    opened = await run_in_threadpool(EditSession, str(message["source"]), request_deadline())
+                    reply = await run_in_threadpool(opened.full_message)
+                    session = opened
+                    await websocket.send_json(reply)
+                elif message.get("type") == "edit":
+                    if session is None:
+                        raise ValueError("Send an 'open' message before editing")
+                    delta = await run_in_threadpool(
+                        session.edit, int(message["offset"]), int(message.get("delete", 0)),
+                        str(message.get("insert", "")), request_deadline()
+                    )
+                    await websocket.send_json(session.delta_message(delta))
+                else:
+                    raise ValueError(f"Unknown message type: {message.get('type')!r}")
+            except (KeyError, TypeError, ValueError) as e:
+                await websocket.send_json({"type": "error", "message": f"{type(e).__name__}: {e}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _ws_sessions -= 1
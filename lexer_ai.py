@@ -1,14 +1,20 @@
 import sys
 import json
 import time
-import urllib.request
-import urllib.error
+import threading
+
+from ai_batch import batch_main
+from ai_cache import ResponseCache, open_cache
+from ai_http import ConnectionPool, CONNECTION_ERRORS
+from ai_prompt import build_source_digest, PROMPT_TOKEN_BUDGET
 
 # ============================================================
 #  CONFIGURATION - PASTE YOUR GEMINI API KEY HERE
 # ============================================================
 API_KEY = " "
-GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_MODEL = "gemini-2.0-flash"
+GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+GEMINI_BATCH_JOBS = 2  # files analyzed at once by --batch; keep low on the free tier
 
 # ============================================================
 #  TOKEN TYPES
@@ -198,9 +204,16 @@ class Lexer:
 #  AI ENGINE - WITH RETRY LOGIC (NO PIP INSTALL NEEDED)
 # ============================================================
 class AIAssistant:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, http=None):
         self.api_key = api_key
         self.enabled = False
+        self.cache = cache  # ai_cache.ResponseCache, or None to always ask the model
+        self.prompt_budget = PROMPT_TOKEN_BUDGET  # estimated tokens of source per analysis prompt
+        # keep-alive connections, so follow-up calls skip the TCP and TLS handshakes
+        self.http = http if http is not None else ConnectionPool(timeout=60)
+        # after a 429 in batch mode every worker holds off until this time.monotonic()
+        self.rate_lock = threading.Lock()
+        self.resume_at = 0.0
 
         if api_key == "PASTE_YOUR_GEMINI_API_KEY_HERE" or not api_key:
             print("  [!] No API key provided. Running in OFFLINE mode.")
@@ -212,8 +225,24 @@ class AIAssistant:
         self.enabled = True
         print("  [+] AI Assistant ready (key loaded).\n")
 
-    def _call_gemini(self, prompt):
-        """Call Gemini API with AUTOMATIC RETRY on rate limit (429)"""
+    def _hold_off(self, seconds):
+        with self.rate_lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def _wait_for_rate_limit(self):
+        while True:
+            with self.rate_lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _call_gemini(self, prompt, quiet=False):
+        """Call Gemini API with AUTOMATIC RETRY on rate limit (429)
+
+        quiet=True (batch mode) waits silently, and makes every thread
+        sharing this assistant back off together after a 429.
+        """
         url = f"{GEMINI_URL}?key={self.api_key}"
 
         payload = json.dumps({
@@ -226,43 +255,66 @@ class AIAssistant:
         wait_times = [10, 30, 60]  # wait 10s, then 30s, then 60s
 
         for attempt in range(max_retries):
+            if quiet:
+                self._wait_for_rate_limit()
             try:
-                req = urllib.request.Request(
-                    url,
-                    data=payload,
-                    headers={"Content-Type": "application/json"},
-                    method="POST"
+                # reading the whole body hands the connection back for the next call
+                response = self.http.request(
+                    "POST", url, body=payload,
+                    headers={"Content-Type": "application/json"}, timeout=60
                 )
-                with urllib.request.urlopen(req, timeout=60) as response:
-                    data = json.loads(response.read().decode("utf-8"))
-                    return data["candidates"][0]["content"]["parts"][0]["text"]
-
-            except urllib.error.HTTPError as e:
-                if e.code == 429:
-                    wait = wait_times[attempt]
-                    remaining = max_retries - attempt - 1
-                    print(f"  [!] Rate limited by Google. Auto-retrying in {wait} seconds...")
-                    print(f"      (Attempt {attempt + 1}/{max_retries}, {remaining} retries left)")
-                    print(f"      Waiting", end="", flush=True)
-                    for i in range(wait):
-                        time.sleep(1)
-                        print(".", end="", flush=True)
-                    print(" Done!")
-                elif e.code == 400:
-                    raise Exception("Bad request. Check your API key.")
-                elif e.code == 403:
-                    raise Exception("API key invalid or expired. Get a new one from https://aistudio.google.com/app/apikey")
-                else:
-                    raise Exception(f"HTTP Error {e.code}: {e.reason}")
-
-            except urllib.error.URLError as e:
-                raise Exception(f"No internet connection: {e.reason}")
+                body = response.read()
+            except CONNECTION_ERRORS as e:
+                raise Exception(f"No internet connection: {e}")
+
+            if response.status == 200:
+                data = json.loads(body.decode("utf-8"))
+                return data["candidates"][0]["content"]["parts"][0]["text"]
+            elif response.status == 429:
+                wait = wait_times[attempt]
+                if quiet:
+                    retry_after = response.headers.get("Retry-After", "")
+                    self._hold_off(int(retry_after) if retry_after.isdigit() else wait)
+                    continue
+                remaining = max_retries - attempt - 1
+                print(f"  [!] Rate limited by Google. Auto-retrying in {wait} seconds...")
+                print(f"      (Attempt {attempt + 1}/{max_retries}, {remaining} retries left)")
+                print(f"      Waiting", end="", flush=True)
+                for i in range(wait):
+                    time.sleep(1)
+                    print(".", end="", flush=True)
+                print(" Done!")
+            elif response.status == 400:
+                raise Exception("Bad request. Check your API key.")
+            elif response.status == 403:
+                raise Exception("API key invalid or expired. Get a new one from https://aistudio.google.com/app/apikey")
+            else:
+                raise Exception(f"HTTP Error {response.status}: {response.reason}")
 
         raise Exception("Rate limit still active after 3 retries. Wait 2 minutes and try again.")
 
-    def analyze(self, source_code, tokens, errors):
-        if not self.enabled:
-            return None
+    def _ask_model(self, prompt, kind, *parts):
+        """Reuse a cached answer for the same model, request kind and inputs."""
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.key(GEMINI_MODEL, kind, *parts)
+            cached = self.cache.get(key)
+            if cached is not None:
+                print("  [+] Answer loaded from cache (unchanged code and question).\n")
+                return cached
+        response = self._call_gemini(prompt)
+        if key is not None:
+            self.cache.put(key, GEMINI_MODEL, response)
+        return response
+
+    def _analyze_prompt(self, source_code, tokens, errors):
+        """Build the analysis prompt, the parts its cache key is made of, and the
+        ai_prompt.SourceDigest saying how much of the source had to be trimmed."""
+        digest = build_source_digest(source_code, tokens, errors, self.prompt_budget)
+        source_note = ""
+        if digest.trimmed:
+            source_note = (f"(Large file trimmed to fit: {digest.summary()}. "
+                           "Each line starts with its original line number.)\n")
 
         token_summary = {}
         for t in tokens:
@@ -275,7 +327,7 @@ class AIAssistant:
 A lexical analyzer has just tokenized the following source code.
 
 === SOURCE CODE ===
-{source_code}
+{source_note}{digest.text}
 
 === TOKEN SUMMARY ===
 Total tokens: {len(tokens)}
@@ -291,13 +343,38 @@ Provide a SHORT analysis (max 15 lines):
 4. **Security Concerns** (if any, 1-2 lines)
 
 Be concise and helpful for a student learning compiler design."""
+        return prompt, (digest.text, summary_str, error_str), digest
+
+    def analyze(self, source_code, tokens, errors):
+        if not self.enabled:
+            return None
+        prompt, parts, digest = self._analyze_prompt(source_code, tokens, errors)
+        if digest.trimmed:
+            print(f"  [*] Source too large for one prompt; {digest.summary()}.")
 
         try:
             print("  [*] AI is analyzing your code...\n")
-            return self._call_gemini(prompt)
+            return self._ask_model(prompt, "analyze", *parts)
         except Exception as e:
             return f"  [!] AI Error: {e}"
 
+    def analyze_batch(self, source_code, tokens, errors):
+        """Analysis for batch mode: whole answers, no console output, errors raised.
+
+        Safe to call from several threads; returns (answer, came_from_cache, digest).
+        """
+        prompt, parts, digest = self._analyze_prompt(source_code, tokens, errors)
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.key(GEMINI_MODEL, "analyze", *parts)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, True, digest
+        answer = self._call_gemini(prompt, quiet=True)
+        if key is not None:
+            self.cache.put(key, GEMINI_MODEL, answer)
+        return answer, False, digest
+
     def ask_question(self, source_code, question):
         if not self.enabled:
             print("  [!] AI not available. Add your API key to enable.")
@@ -311,7 +388,7 @@ Student's question: {question}
 Give a clear, concise answer (max 10 lines). Be educational."""
 
         try:
-            return self._call_gemini(prompt)
+            return self._ask_model(prompt, "ask", source_code or "", question)
         except Exception as e:
             return f"  [!] AI Error: {e}"
 
@@ -361,6 +438,10 @@ def display_ai(response):
 #  MAIN PROGRAM
 # ============================================================
 def main():
+    if "--batch" in sys.argv[1:]:
+        # python lexer_ai.py --batch src/ [--jobs N] [--report FILE]
+        sys.exit(batch_main(lambda cache: AIAssistant(API_KEY, cache=cache), Lexer, GEMINI_BATCH_JOBS))
+
     print()
     print("  +=======================================================+")
     print("  |   LEXICAL ANALYZER WITH AI SUGGESTIONS                 |")
@@ -370,7 +451,7 @@ def main():
     print()
 
     print("  [*] Initializing AI Assistant...")
-    ai = AIAssistant(API_KEY)
+    ai = AIAssistant(API_KEY, cache=open_cache())
     source = None
 
     while True:
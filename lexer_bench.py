@@ -0,0 +1,288 @@
+import sys
+import io
+import gc
+import json
+import time
+import random
+import tracemalloc
+import argparse
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+import Lexer_no_ai
+import lexer_ai
+import lexer_olama
+
+# ==================== CORPUS GENERATOR ====================
+SHAPES = ("c", "python", "comments", "strings", "long_lines")
+
+C_TYPES = ["int", "float", "double", "char", "long", "unsigned"]
+C_OPS = ["+", "-", "*", "/", "%", "<<", ">>", "&", "|", "^"]
+C_CMPS = ["==", "!=", "<=", ">=", "<", ">", "&&", "||"]
+WORDS = ["alpha", "beta", "gamma", "delta", "count", "index", "buffer", "total",
+         "value", "result", "node", "item", "left", "right", "size", "offset"]
+
+
+def _name(rng):
+    return rng.choice(WORDS) + ("_" + str(rng.randrange(100)) if rng.random() < 0.4 else "")
+
+
+def _number(rng):
+    if rng.random() < 0.3:
+        return f"{rng.randrange(1000)}.{rng.randrange(100)}"
+    return str(rng.randrange(100000))
+
+
+def _expr(rng, depth=0):
+    if depth > 2 or rng.random() < 0.3:
+        return _name(rng) if rng.random() < 0.6 else _number(rng)
+    return f"{_expr(rng, depth + 1)} {rng.choice(C_OPS)} {_expr(rng, depth + 1)}"
+
+
+def _string(rng, length=None):
+    length = length or rng.randrange(4, 40)
+    body = "".join(rng.choice("abcdefghij klmnop%d,.") for _ in range(length))
+    if rng.random() < 0.5:
+        body += rng.choice(["\\n", "\\t", "\\\"", "\\\\"])
+    return '"' + body + '"'
+
+
+def _c_function(rng):
+    lines = [f"{rng.choice(C_TYPES)} {_name(rng)}({rng.choice(C_TYPES)} {_name(rng)}) {{"]
+    for _ in range(rng.randrange(3, 12)):
+        roll = rng.random()
+        if roll < 0.35:
+            lines.append(f"    {rng.choice(C_TYPES)} {_name(rng)} = {_expr(rng)};")
+        elif roll < 0.55:
+            lines.append(f"    if ({_name(rng)} {rng.choice(C_CMPS)} {_number(rng)}) {{")
+            lines.append(f"        {_name(rng)}++;")
+            lines.append("    }")
+        elif roll < 0.7:
+            lines.append(f"    for (int i = 0; i < {_number(rng)}; i++) {_name(rng)} += i;")
+        elif roll < 0.85:
+            lines.append(f"    printf({_string(rng)}, {_name(rng)});")
+        else:
+            lines.append(f"    // {' '.join(rng.choice(WORDS) for _ in range(rng.randrange(2, 8)))}")
+    lines.append(f"    return {_expr(rng)};")
+    lines.append("}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _python_function(rng):
+    lines = [f"def {_name(rng)}({_name(rng)}, {_name(rng)}):"]
+    for _ in range(rng.randrange(3, 10)):
+        roll = rng.random()
+        if roll < 0.4:
+            lines.append(f"    {_name(rng)} = {_expr(rng)}")
+        elif roll < 0.6:
+            lines.append(f"    if {_name(rng)} is not None and {_name(rng)} in {_name(rng)}:")
+            lines.append(f"        return {_string(rng)}")
+        elif roll < 0.8:
+            lines.append(f"    print({_string(rng)}, {_name(rng)})")
+        else:
+            lines.append(f"    # {' '.join(rng.choice(WORDS) for _ in range(rng.randrange(2, 8)))}")
+    lines.append(f"    return {_expr(rng)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def _comment_block(rng):
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(20, 120)))
+    if rng.random() < 0.5:
+        return "/* " + words.replace(" gamma ", "\n * gamma ") + " */\n" + _c_function(rng)
+    return "".join(f"// {rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(WORDS)}\n" for _ in range(8))
+
+
+def _string_block(rng):
+    return "".join(f"char *{_name(rng)} = {_string(rng, rng.randrange(20, 200))};\n" for _ in range(6))
+
+
+def _long_line(rng):
+    return f"int {_name(rng)} = " + " + ".join(_expr(rng) for _ in range(rng.randrange(300, 800))) + ";\n"
+
+
+SNIPPETS = {
+    "c": _c_function,
+    "python": _python_function,
+    "comments": _comment_block,
+    "strings": _string_block,
+    "long_lines": _long_line,
+}
+
+# Distinct snippets generated per corpus; bigger corpora sample from them
+SNIPPET_POOL = 512
+
+
+def generate_corpus(shape, size, seed=0):
+    # Same shape, size and seed always give the same text
+    rng = random.Random(f"{shape}:{seed}")
+    make = SNIPPETS[shape]
+    pool = [make(rng) for _ in range(SNIPPET_POOL)]
+    parts, length = [], 0
+    while length < size:
+        snippet = pool[rng.randrange(SNIPPET_POOL)]
+        parts.append(snippet)
+        length += len(snippet)
+    return "".join(parts)[:size]
+
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+# ==================== IMPLEMENTATIONS ====================
+# name -> (prepare(source), run(prepared) -> tokens or token count).
+# prepare() runs outside the timed region.
+def _count_stream(stream):
+    return sum(1 for _ in Lexer_no_ai.Lexer.iter_tokens(stream))
+
+
+IMPLEMENTATIONS = {
+    "no_ai.regex": (lambda src: src, lambda src: Lexer_no_ai.Lexer(src).tokenize()),
+    "no_ai.char": (lambda src: src, lambda src: Lexer_no_ai.Lexer(src, engine="char").tokenize()),
+    "no_ai.columnar": (lambda src: src, lambda src: Lexer_no_ai.Lexer(src, columnar=True).tokenize()),
+    "no_ai.bytes": (lambda src: src.encode("utf-8"), lambda src: Lexer_no_ai.Lexer(src, columnar=True).tokenize()),
+    "no_ai.stream": (io.StringIO, _count_stream),
+    "lexer_ai": (lambda src: src, lambda src: lexer_ai.Lexer(src).tokenize()),
+    "lexer_olama": (lambda src: src, lambda src: lexer_olama.Lexer(src).tokenize()),
+}
+
+
+# ==================== MEASUREMENT ====================
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # macOS reports bytes
+
+
+def measure(implementation, shape, size, seed=0, repeat=3):
+    # Runs inside a fresh worker process, so peak RSS belongs to this case
+    source = generate_corpus(shape, size, seed)
+    prepare, run = IMPLEMENTATIONS[implementation]
+    gc.collect()
+    rss_before = peak_rss_kb()
+
+    best = None
+    for _ in range(repeat):
+        data = prepare(source)
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        result = run(data)
+        elapsed = time.perf_counter() - start
+        # blocks still alive while the result is held: what the tokens keep,
+        # not how many allocations it took to make them
+        blocks = sys.getallocatedblocks() - blocks_before
+        tokens = result if isinstance(result, int) else len(result)
+        del result, data
+        if best is None or elapsed < best[0]:
+            best = (elapsed, tokens, blocks)
+
+    elapsed, tokens, blocks = best
+    rss_after = peak_rss_kb()
+
+    # Allocation pressure from one more, untimed run: tracing slows it down
+    data = prepare(source)
+    tracemalloc.start()
+    result = run(data)
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result, data
+    return {
+        "implementation": implementation,
+        "shape": shape,
+        "size": size,
+        "tokens": tokens,
+        "seconds": round(elapsed, 6),
+        "tokens_per_s": round(tokens / elapsed) if elapsed else None,
+        "mb_per_s": round(size / elapsed / 1e6, 3) if elapsed else None,
+        "peak_rss_kb": rss_after,
+        "rss_before_kb": rss_before,
+        "retained_blocks_per_token": round(blocks / tokens, 3) if tokens else None,
+        "peak_alloc_bytes_per_token": round(alloc_peak / tokens, 1) if tokens else None,
+    }
+
+
+def run_suite(implementations, shapes, sizes, seed=0, repeat=3, isolate=True):
+    # Yields one result dict per (implementation, shape, size)
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        for shape in shapes:
+            for implementation in implementations:
+                if not isolate:
+                    yield measure(implementation, shape, size, seed, repeat)
+                    continue
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    yield pool.submit(measure, implementation, shape, size, seed, repeat).result()
+
+
+def display_results(results):
+    print(f"  {'IMPLEMENTATION':<16} {'SHAPE':<11} {'SIZE':>10} {'TOKENS':>10} "
+          f"{'TOK/S':>11} {'MB/S':>8} {'PEAK RSS KB':>12} {'KEPT BLK/TOK':>12} {'PEAK B/TOK':>10}")
+    print("-" * 111)
+    for r in results:
+        print(f"  {r['implementation']:<16} {r['shape']:<11} {r['size']:>10} {r['tokens']:>10} "
+              f"{r['tokens_per_s'] or 0:>11} {r['mb_per_s'] or 0:>8} {r['peak_rss_kb'] or 0:>12} "
+              f"{r['retained_blocks_per_token'] or 0:>12} {r['peak_alloc_bytes_per_token'] or 0:>10}")
+        sys.stdout.flush()
+        yield r
+
+
+# ==================== MAIN ====================
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer throughput benchmark")
+    parser.add_argument("--impl", default=",".join(IMPLEMENTATIONS),
+                        help=f"comma-separated implementations ({', '.join(IMPLEMENTATIONS)})")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"comma-separated corpus shapes ({', '.join(SHAPES)})")
+    parser.add_argument("--sizes", default="1K,64K,1M", help="comma-separated corpus sizes, e.g. 1K,1M,100M")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results ('-' for stdout)")
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="measure in this process (faster, but peak RSS is shared)")
+    args = parser.parse_args()
+
+    implementations = args.impl.split(",")
+    shapes = args.shapes.split(",")
+    for name in implementations:
+        if name not in IMPLEMENTATIONS:
+            parser.error(f"unknown implementation '{name}'")
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error(f"unknown shape '{shape}'")
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+
+    results = run_suite(implementations, shapes, sizes, args.seed, args.repeat, not args.no_isolate)
+    if args.json != "-":
+        results = display_results(results)
+    results = list(results)
+
+    if args.json:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\n[*] Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,22 @@
+import os
 import sys
 import json
 import time
-import urllib.request
-import urllib.error
+
+from ai_batch import batch_main
+from ai_cache import ResponseCache, open_cache
+from ai_http import ConnectionPool, CONNECTION_ERRORS
+from ai_prompt import build_source_digest, PROMPT_TOKEN_BUDGET
 
 # ============================================================
 #  CONFIGURATION - OLLAMA (LOCAL AI - NO API KEY NEEDED!)
 # ============================================================
 OLLAMA_URL = "http://localhost:11434/api/generate"
+OLLAMA_TAGS_URL = "http://localhost:11434/api/tags"
 OLLAMA_MODEL = "llama3"  # Change to "mistral", "gemma2", "codellama", etc.
+OLLAMA_STREAM = True  # Print answers as they are generated instead of all at once
+# Files analyzed at once by --batch; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_BATCH_JOBS = int(os.environ.get("OLLAMA_NUM_PARALLEL") or 4)
 
 # ============================================================
 #  TOKEN TYPES
@@ -197,17 +205,69 @@ class Lexer:
 # ============================================================
 #  AI ENGINE - OLLAMA LOCAL (NO API KEY, NO RATE LIMITS!)
 # ============================================================
+class StreamedAnswer:
+    """A streaming Ollama reply: iterate over it to get text as it is generated.
+
+    Once fully read, text holds the whole answer, ttft the seconds until the
+    first text arrived and tokens_per_s the generation rate Ollama reports.
+    """
+
+    def __init__(self, response, started, on_complete=None):
+        self.response = response  # ai_http.PooledResponse with an NDJSON body
+        self.started = started
+        self.on_complete = on_complete  # called with the text if the stream finishes
+        self.text = ""
+        self.ttft = None
+        self.tokens_per_s = None
+
+    def __iter__(self):
+        pieces = []
+        done = False
+        try:
+            for line in self.response:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise Exception(f"Ollama error: {chunk['error']}")
+                text = chunk.get("response", "")
+                if text:
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - self.started
+                    pieces.append(text)
+                    yield text
+                if chunk.get("done"):
+                    # keep reading to the end of the body so the connection can be reused
+                    done = True
+                    count, duration = chunk.get("eval_count"), chunk.get("eval_duration")
+                    if count and duration:
+                        self.tokens_per_s = count / (duration / 1e9)
+        finally:
+            self.response.close()
+        self.text = "".join(pieces)
+        if not done:
+            raise Exception("Ollama closed the connection before the answer was complete.")
+        if self.tokens_per_s is None and self.ttft is not None:
+            elapsed = time.perf_counter() - self.started - self.ttft
+            if elapsed > 0:
+                self.tokens_per_s = len(pieces) / elapsed
+        if self.on_complete is not None:
+            self.on_complete(self.text)
+
+
 class AIAssistant:
-    def __init__(self):
+    def __init__(self, cache=None, http=None):
         self.enabled = False
+        self.cache = cache  # ai_cache.ResponseCache, or None to always ask the model
+        self.prompt_budget = PROMPT_TOKEN_BUDGET  # estimated tokens of source per analysis prompt
+        # keep-alive connections, reused by every analyze/ask_question call
+        self.http = http if http is not None else ConnectionPool(timeout=120)
 
         print("  [*] Checking Ollama connection...")
         try:
-            req = urllib.request.Request(
-                "http://localhost:11434/api/tags",
-                method="GET"
-            )
-            with urllib.request.urlopen(req, timeout=5) as response:
+            with self.http.request("GET", OLLAMA_TAGS_URL, timeout=5) as response:
+                if response.status != 200:
+                    raise Exception(f"HTTP {response.status} {response.reason}")
                 data = json.loads(response.read().decode("utf-8"))
                 models = [m["name"] for m in data.get("models", [])]
 
@@ -229,7 +289,7 @@ class AIAssistant:
                 print(f"  [+] AI Assistant ready! (Using Ollama - {OLLAMA_MODEL})")
                 print(f"  [+] No API key needed. No rate limits. 100% local.\n")
 
-        except urllib.error.URLError:
+        except CONNECTION_ERRORS:
             print("  [!] Cannot connect to Ollama.")
             print("  [!] Make sure Ollama is running: ollama serve")
             print(f"  [!] And pull a model: ollama pull {OLLAMA_MODEL}")
@@ -237,12 +297,16 @@ class AIAssistant:
         except Exception as e:
             print(f"  [!] Ollama check failed: {e}\n")
 
-    def _call_ollama(self, prompt):
-        """Call Ollama local API - NO rate limits, NO API key!"""
+    def _call_ollama(self, prompt, stream=False):
+        """Call Ollama local API - NO rate limits, NO API key!
+
+        With stream=True a StreamedAnswer is returned as soon as Ollama
+        starts answering; otherwise the whole answer text.
+        """
         payload = json.dumps({
             "model": OLLAMA_MODEL,
             "prompt": prompt,
-            "stream": False,
+            "stream": stream,
             "options": {
                 "temperature": 0.7,
                 "num_predict": 512  # Keep responses concise
@@ -250,25 +314,53 @@ class AIAssistant:
         }).encode("utf-8")
 
         try:
-            req = urllib.request.Request(
-                OLLAMA_URL,
-                data=payload,
-                headers={"Content-Type": "application/json"},
-                method="POST"
+            started = time.perf_counter()
+            # Longer timeout since local models can be slower; when streaming
+            # it applies to each read, not to the whole answer
+            response = self.http.request(
+                "POST", OLLAMA_URL, body=payload,
+                headers={"Content-Type": "application/json"}, timeout=120
             )
-            # Longer timeout since local models can be slower
-            with urllib.request.urlopen(req, timeout=120) as response:
-                data = json.loads(response.read().decode("utf-8"))
-                return data.get("response", "No response from AI.")
-
-        except urllib.error.URLError:
+            if response.status != 200:
+                detail = response.read().decode("utf-8", "replace")
+                raise Exception(f"HTTP {response.status} {response.reason}: {detail[:200]}")
+            if stream:
+                return StreamedAnswer(response, started)
+            data = json.loads(response.read().decode("utf-8"))
+            return data.get("response", "No response from AI.")
+
+        except CONNECTION_ERRORS:
             raise Exception("Lost connection to Ollama. Is it still running? (ollama serve)")
         except Exception as e:
             raise Exception(f"Ollama error: {e}")
 
-    def analyze(self, source_code, tokens, errors):
-        if not self.enabled:
-            return None
+    def _ask_model(self, prompt, kind, *parts):
+        """Reuse a cached answer for the same model, request kind and inputs."""
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.key(OLLAMA_MODEL, kind, *parts)
+            cached = self.cache.get(key)
+            if cached is not None:
+                print("  [+] Answer loaded from cache (unchanged code and question).\n")
+                return cached
+        if OLLAMA_STREAM:
+            answer = self._call_ollama(prompt, stream=True)
+            if key is not None:
+                answer.on_complete = lambda text: self.cache.put(key, OLLAMA_MODEL, text)
+            return answer
+        response = self._call_ollama(prompt)
+        if key is not None:
+            self.cache.put(key, OLLAMA_MODEL, response)
+        return response
+
+    def _analyze_prompt(self, source_code, tokens, errors):
+        """Build the analysis prompt, the parts its cache key is made of, and the
+        ai_prompt.SourceDigest saying how much of the source had to be trimmed."""
+        digest = build_source_digest(source_code, tokens, errors, self.prompt_budget)
+        source_note = ""
+        if digest.trimmed:
+            source_note = (f"(Large file trimmed to fit: {digest.summary()}. "
+                           "Each line starts with its original line number.)\n")
 
         token_summary = {}
         for t in tokens:
@@ -281,7 +373,7 @@ class AIAssistant:
 A lexical analyzer has just tokenized the following source code.
 
 === SOURCE CODE ===
-{source_code}
+{source_note}{digest.text}
 
 === TOKEN SUMMARY ===
 Total tokens: {len(tokens)}
@@ -297,13 +389,38 @@ Provide a SHORT analysis (max 15 lines):
 4. **Security Concerns** (if any, 1-2 lines)
 
 Be concise and helpful for a student learning compiler design."""
+        return prompt, (digest.text, summary_str, error_str), digest
+
+    def analyze(self, source_code, tokens, errors):
+        if not self.enabled:
+            return None
+        prompt, parts, digest = self._analyze_prompt(source_code, tokens, errors)
+        if digest.trimmed:
+            print(f"  [*] Source too large for one prompt; {digest.summary()}.")
 
         try:
             print("  [*] AI is analyzing your code...\n")
-            return self._call_ollama(prompt)
+            return self._ask_model(prompt, "analyze", *parts)
         except Exception as e:
             return f"  [!] AI Error: {e}"
 
+    def analyze_batch(self, source_code, tokens, errors):
+        """Analysis for batch mode: whole answers, no console output, errors raised.
+
+        Safe to call from several threads; returns (answer, came_from_cache, digest).
+        """
+        prompt, parts, digest = self._analyze_prompt(source_code, tokens, errors)
+        key = None
+        if self.cache is not None:
+            key = ResponseCache.key(OLLAMA_MODEL, "analyze", *parts)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, True, digest
+        answer = self._call_ollama(prompt)
+        if key is not None:
+            self.cache.put(key, OLLAMA_MODEL, answer)
+        return answer, False, digest
+
     def ask_question(self, source_code, question):
         if not self.enabled:
             print("  [!] AI not available. Make sure Ollama is running.")
@@ -317,7 +434,7 @@ Student's question: {question}
 Give a clear, concise answer (max 10 lines). Be educational."""
 
         try:
-            return self._call_ollama(prompt)
+            return self._ask_model(prompt, "ask", source_code or "", question)
         except Exception as e:
             return f"  [!] AI Error: {e}"
 
@@ -359,7 +476,19 @@ def display_ai(response):
         print("\n" + "*" * 70)
         print("   AI ASSISTANT SUGGESTIONS")
         print("*" * 70)
-        print(response)
+        if isinstance(response, StreamedAnswer):
+            # print each piece as soon as Ollama sends it
+            try:
+                for text in response:
+                    print(text, end="", flush=True)
+                print()
+            except Exception as e:
+                print(f"\n  [!] AI Error: {e}")
+            if response.ttft is not None:
+                rate = f" | {response.tokens_per_s:.1f} tokens/s" if response.tokens_per_s else ""
+                print(f"  [first token after {response.ttft:.2f}s{rate}]")
+        else:
+            print(response)
         print("*" * 70)
 
 
@@ -367,6 +496,10 @@ def display_ai(response):
 #  MAIN PROGRAM
 # ============================================================
 def main():
+    if "--batch" in sys.argv[1:]:
+        # python lexer_olama.py --batch src/ [--jobs N] [--report FILE]
+        sys.exit(batch_main(lambda cache: AIAssistant(cache=cache), Lexer, OLLAMA_BATCH_JOBS))
+
     print()
     print("  +=======================================================+")
     print("  |   LEXICAL ANALYZER WITH AI SUGGESTIONS                 |")
@@ -376,7 +509,7 @@ def main():
     print()
 
     print("  [*] Initializing AI Assistant...")
-    ai = AIAssistant()
+    ai = AIAssistant(cache=open_cache())
     source = None
 
     while True:
@@ -0,0 +1,209 @@
+import struct
+from itertools import accumulate, chain
+from operator import sub
+
+from Lexer_no_ai import TokenBuffer, TOKEN_TYPE_NAMES, TOKEN_TYPE_IDS, NEWLINE_VALUE, span_text
+
+# ==================== FORMAT ====================
+# Packed token stream, all integers little-endian:
+#
+#   header   magic "LXTK", version u8, flags u8, type count u16,
+#            token count u32, string count u32, error count u32
+#   types    type count strings          (varint byte length + UTF-8)
+#   strings  string count strings        (token values, each stored once)
+#   errors   error count strings
+#   columns  type_ids, value_ids, gaps, lengths, line_deltas, column_deltas
+#
+# Each column is an encoding byte, a varint byte length and the data:
+# RAW_COLUMN holds one byte per value (every value below 0x80), VARINT_COLUMN
+# holds LEB128 varints. Per token:
+#   gap          start - end of the previous token
+#   length       end - start
+#   line_delta   line - line of the previous token (the first counts from 1)
+#   column_delta column - column of the previous token on the same line,
+#                or the column itself on a new line
+MAGIC = b"LXTK"
+PACK_VERSION = 1
+HEADER = struct.Struct("<4sBBHIII")
+FLAG_TRUNCATED = 1
+RAW_COLUMN = 0
+VARINT_COLUMN = 1
+MEDIA_TYPE = "application/octet-stream"
+
+
+# ==================== ENCODER ====================
+def varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def encode_strings(strings):
+    out = bytearray()
+    for text in strings:
+        data = text.encode("utf-8", "surrogatepass")
+        out += varint(len(data))
+        out += data
+    return out
+
+
+def encode_column(values):
+    # Small values (the common case) are copied as bytes in one C call
+    if not values or max(values) < 0x80:
+        data = bytes(values)
+        encoding = RAW_COLUMN
+    else:
+        data = bytearray()
+        for value in values:
+            while value >= 0x80:
+                data.append((value & 0x7F) | 0x80)
+                value >>= 7
+            data.append(value)
+        encoding = VARINT_COLUMN
+    return bytes([encoding]) + varint(len(data)) + data
+
+
+def pack_tokens(tokens, errors=(), truncated=False):
+    # tokens: a columnar TokenBuffer with lines and columns filled in
+    if not isinstance(tokens, TokenBuffer) or tokens.line_index is not None:
+        raise TypeError("pack_tokens() needs a TokenBuffer lexed without lazy_positions")
+    source = tokens.source
+    types, starts, ends, lines, columns = tokens.types, tokens.starts, tokens.ends, tokens.lines, tokens.columns
+    newline_id = TOKEN_TYPE_IDS["NEWLINE"]
+
+    # Intern values: repeated identifiers, keywords and operators cost one index each
+    if isinstance(source, str):
+        values = [NEWLINE_VALUE if t == newline_id else source[s:e] for t, s, e in zip(types, starts, ends)]
+    else:
+        values = [NEWLINE_VALUE if t == newline_id else span_text(source, s, e) for t, s, e in zip(types, starts, ends)]
+    interned = {}
+    value_ids = [interned.setdefault(value, len(interned)) for value in values]
+
+    gaps = list(map(sub, starts, chain((0,), ends)))
+    lengths = list(map(sub, ends, starts))
+    line_deltas = list(map(sub, lines, chain((1,), lines)))
+    column_deltas = [
+        column - previous if delta == 0 else column
+        for column, previous, delta in zip(columns, chain((1,), columns), line_deltas)
+    ]
+
+    flags = FLAG_TRUNCATED if truncated else 0
+    return b"".join([
+        HEADER.pack(MAGIC, PACK_VERSION, flags, len(TOKEN_TYPE_NAMES), len(types), len(interned), len(errors)),
+        encode_strings(TOKEN_TYPE_NAMES),
+        encode_strings(interned),
+        encode_strings(errors),
+        encode_column(types.tolist()),
+        encode_column(value_ids),
+        encode_column(gaps),
+        encode_column(lengths),
+        encode_column(line_deltas),
+        encode_column(column_deltas),
+    ])
+
+
+# ==================== DECODER ====================
+class PackedTokens:
+    """Decoded packed token stream, held as parallel lists like TokenBuffer."""
+
+    def __init__(self, type_names, type_ids, values, starts, ends, lines, columns, errors, truncated):
+        self.type_names = type_names
+        self.type_ids = type_ids
+        self.values = values
+        self.starts = starts
+        self.ends = ends
+        self.lines = lines
+        self.columns = columns
+        self.errors = errors
+        self.truncated = truncated
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def rows(self):
+        # (type, value, line, column) tuples, as TokenBuffer.rows() yields them
+        names = self.type_names
+        for type_id, value, line, column in zip(self.type_ids, self.values, self.lines, self.columns):
+            yield names[type_id], value, line, column
+
+
+def read_varint(view, pos):
+    value = shift = 0
+    while True:
+        byte = view[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_strings(view, pos, count):
+    strings = []
+    for _ in range(count):
+        length, pos = read_varint(view, pos)
+        strings.append(str(view[pos:pos + length], "utf-8", "surrogatepass"))
+        pos += length
+    return strings, pos
+
+
+def read_column(view, pos, count):
+    encoding = view[pos]
+    length, pos = read_varint(view, pos + 1)
+    end = pos + length
+    if encoding == RAW_COLUMN:
+        # one byte per value: a single C-level copy
+        return view[pos:end].tolist(), end
+    values = []
+    append = values.append
+    value = shift = 0
+    for byte in view[pos:end]:
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            append(value)
+            value = shift = 0
+        else:
+            shift += 7
+    if len(values) != count:
+        raise ValueError("packed token column has the wrong length")
+    return values, end
+
+
+def unpack_tokens(data):
+    # data: bytes, bytearray, mmap or anything else exposing the buffer protocol
+    view = memoryview(data).cast("B")
+    if len(view) < HEADER.size:
+        raise ValueError("truncated packed token header")
+    magic, version, flags, type_count, token_count, string_count, error_count = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("not a packed token stream")
+    if version != PACK_VERSION:
+        raise ValueError(f"unsupported packed token version {version}")
+
+    pos = HEADER.size
+    type_names, pos = read_strings(view, pos, type_count)
+    strings, pos = read_strings(view, pos, string_count)
+    errors, pos = read_strings(view, pos, error_count)
+    columns = []
+    for _ in range(6):
+        values, pos = read_column(view, pos, token_count)
+        columns.append(values)
+    type_ids, value_ids, gaps, lengths, line_deltas, column_deltas = columns
+
+    # Undo the delta coding with C-level accumulate() where it applies
+    offsets = list(accumulate(chain.from_iterable(zip(gaps, lengths))))
+    starts, ends = offsets[0::2], offsets[1::2]
+    lines = list(accumulate(line_deltas, initial=1))[1:]
+    token_columns = []
+    column = 1
+    for line_delta, column_delta in zip(line_deltas, column_deltas):
+        column = column + column_delta if line_delta == 0 else column_delta
+        token_columns.append(column)
+
+    return PackedTokens(
+        type_names, type_ids, [strings[i] for i in value_ids],
+        starts, ends, lines, token_columns, errors, bool(flags & FLAG_TRUNCATED),
+    )